@@ -0,0 +1,69 @@
+"""Benchmark the gradient space projection on a cohort sized dataset."""
+import os
+import tempfile
+import timeit
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from nkicap.gradient import load_cap_maps, map_space, project_to_gradient
+from nkicap.manifest import Manifest
+
+N_SUBJECTS = 711
+N_CAPS = 8
+N_ROI = 1054
+
+
+def per_column(cap_maps):
+    """The original implementation: one call per CAP column per subject."""
+    return [[map_space(cap) for cap in subject] for subject in cap_maps]
+
+
+def batch(cap_maps):
+    return project_to_gradient(cap_maps)
+
+
+def _cap_map_paths(tmpdir):
+    """Subject CAP maps of the real dataset, or a synthetic one of the same size."""
+    paths = list(Manifest.load().resolved()["subject"].values())
+    if all(Path(path).exists() for path in paths):
+        return paths
+
+    rng = np.random.default_rng(0)
+    cap_labels = [f"cap_{i+1:02d}" for i in range(N_CAPS)]
+    paths = []
+    for i in range(N_SUBJECTS):
+        path = Path(tmpdir) / f"sub-{i:04d}_desc-capmap_bold.tsv"
+        capmap = pd.DataFrame(
+            rng.normal(size=(N_ROI, N_CAPS)),
+            columns=cap_labels,
+            index=range(1, N_ROI + 1),
+        )
+        capmap.to_csv(path, sep="\t")
+        paths.append(path)
+    return paths
+
+
+def ingestion_scaling():
+    """Time reading the subject maps with increasing number of processes."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = _cap_map_paths(tmpdir)
+        workers = 1
+        while workers <= os.cpu_count():
+            duration = min(
+                timeit.repeat(lambda: load_cap_maps(paths, workers), number=1, repeat=3)
+            )
+            print(f"load_cap_maps, {workers} workers: {duration:.3f} s")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    cap_maps = rng.normal(size=(N_SUBJECTS + 1, N_CAPS, N_ROI))
+
+    for func in [per_column, batch]:
+        duration = min(timeit.repeat(lambda: func(cap_maps), number=1, repeat=3))
+        print(f"{func.__name__}: {duration:.3f} s")
+
+    ingestion_scaling()
@@ -0,0 +1,75 @@
+"""Benchmark load latency and memory of the tsv and parquet backends."""
+import shutil
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from nkicap import Data, read_tsv
+from nkicap.utils import get_project_path
+
+N_SUBJECTS = 711
+N_PHENOTYPES = 2000
+
+QUERIES = {
+    "full table": {},
+    "cap columns": {"usecols": [f"occ_cap_{i+1:02d}" for i in range(8)]},
+    "age 20-40": {"filters": [("age", ">=", 20), ("age", "<", 40)]},
+}
+
+
+def _dataset(tmpdir):
+    """
+    A copy of the enhanced NKI table, or a synthetic one with many phenotype
+    columns. The parquet copy is written next to it, in `tmpdir`.
+    """
+    path = Path(tmpdir) / "enhanced_nki.tsv"
+    source = Path(get_project_path()) / "data/enhanced_nki.tsv"
+    if source.exists():
+        shutil.copyfile(source, path)
+        return path
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        rng.normal(size=(N_SUBJECTS, N_PHENOTYPES)),
+        columns=[f"pheno_{i:04d}" for i in range(N_PHENOTYPES)],
+        index=pd.Index([f"A{i:08d}" for i in range(N_SUBJECTS)], name="participant_id"),
+    )
+    df.insert(0, "age", rng.integers(18, 85, N_SUBJECTS))
+    for i in range(8):
+        df[f"occ_cap_{i+1:02d}"] = rng.random(N_SUBJECTS)
+    df.to_csv(path, sep="\t")
+    return path
+
+
+def measure(func):
+    """Wall time and peak traced memory of a call."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak / 1e6
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = _dataset(tmpdir)
+        read_tsv(path, backend="parquet")  # convert once
+
+        for name, kargs in QUERIES.items():
+            for backend in ["tsv", "parquet"]:
+                duration, peak = measure(
+                    lambda: read_tsv(path, backend=backend, index_col=0, **kargs)
+                )
+                print(f"{name}, {backend}: {duration:.3f} s, {peak:.1f} MB")
+
+        for backend in ["tsv", "parquet"]:
+            duration, peak = measure(
+                lambda: Data(path, backend=backend, lazy=True).load("occ")
+            )
+            print(f"lazy Data, {backend}: {duration:.3f} s, {peak:.1f} MB")
@@ -3,28 +3,28 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import seaborn as sns
-from scipy.stats import spearmanr, zscore
 from scipy.stats.stats import pearsonr
 
 from nkicap import Data
+from nkicap.cca import bootstrap_cca, cca
+from nkicap.figures import figure_job, run_figures
+from nkicap.stats import permutation_corr
 
 DATA = "data/enhanced_nki.tsv"
 
 
-def plot_demo(data, basepath="results/descriptive"):
+def plot_demo(dataset):
     """Check demographic."""
-    dataset = data.load()
-    plt.figure()
+    fig = plt.figure()
     sns.histplot(data=dataset, x="age", hue="sex", multiple="stack")
     plt.title("Demographics")
-    plt.savefig(f"{basepath}/demographic.png", dpi=300)
+    return fig
 
 
-def plot_occ_dur(data, basepath="results/descriptive"):
+def plot_occ_dur(cap):
     """Sanity check on the CAP occurence and duration."""
-    cap = data.load("cap")
     pearsons = cap.corr().iloc[8:, :8]
-    plt.figure(figsize=(7, 5))
+    fig = plt.figure(figsize=(7, 5))
     sns.heatmap(
         pearsons,
         center=0,
@@ -36,33 +36,61 @@ def plot_occ_dur(data, basepath="results/descriptive"):
     )
     plt.title("CAP correlations (sainity check)")
     plt.tight_layout()
-    plt.savefig(f"{basepath}/occ_dur.png", dpi=300)
+    return fig
+
 
+def plot_corr(cap, mriq, title, n_perm=0):
+    """Simple correlation between all CAP features and MRIQ.
 
-def plot_corr(cap, mriq, prefix, basepath="results/descriptive"):
-    """Simple correlation between all CAP features and MRIQ."""
+    With `n_perm` > 0, pairs significant at FWER corrected p < 0.05 from a
+    permutation test are marked with "*".
+    """
     dataset = pd.concat([mriq, cap], axis=1)
-    mriq_labels = mriq.columns.tolist()
     corr_mat_size = cap.shape[1]
-
-    pearsons = dataset.corr().iloc[-corr_mat_size:, :-corr_mat_size]
-    corr_mat_mriq(pearsons.T, "pearsons r", f"{basepath}/{prefix}_pearsons.png")
-    sc = spearmanr(dataset)
-    spearman = pd.DataFrame(
-        sc[0][-corr_mat_size:, :-corr_mat_size],
-        index=pearsons.index,
-        columns=mriq_labels,
-    )
-    corr_mat_mriq(spearman.T, "spearman r", f"{basepath}/{prefix}_spearmans.png")
-
-
-def corr_mat_mriq(mat, title, path):
+    corr = dataset.corr().iloc[-corr_mat_size:, :-corr_mat_size]
+    sig = None
+    if n_perm:
+        _, _, p_fwer = permutation_corr(cap, mriq, n_perm=n_perm, seed=42)
+        sig = p_fwer.T.values < 0.05
+    return corr_mat_mriq(corr.T, title, sig)
+
+
+def corr_jobs(cap, mriq, prefix, basepath="results/descriptive", n_perm=0, ranks=None):
+    """Figures of the Pearson's and Spearman's correlations of CAP and MRIQ.
+
+    Spearman's correlation is Pearson's correlation of the ranks. `ranks`
+    are the ranked (cap, mriq), such as from `Data.load(..., transform="rank")`,
+    and are computed when not given.
+    """
+    if ranks is None:
+        ranks = cap.rank(), mriq.rank()
+    return [
+        figure_job(
+            f"{basepath}/{prefix}_pearsons.png",
+            plot_corr,
+            cap,
+            mriq,
+            "pearsons r",
+            n_perm,
+        ),
+        figure_job(
+            f"{basepath}/{prefix}_spearmans.png",
+            plot_corr,
+            *ranks,
+            "spearman r",
+            n_perm,
+        ),
+    ]
+
+
+def corr_mat_mriq(mat, title, sig=None):
     """Plot the simple correlation and enough space to show the full questions."""
-    plt.figure(figsize=(13, 7))
+    fig = plt.figure(figsize=(13, 7))
     sns.heatmap(
         mat,
         center=0,
-        annot=False,
+        annot=False if sig is None else np.where(sig, "*", ""),
+        fmt="",
         square=True,
         linewidths=0.02,
         vmax=0.15,
@@ -70,44 +98,38 @@ def corr_mat_mriq(mat, title, path):
     )
     plt.title(title)
     plt.tight_layout()
-    plt.savefig(path, dpi=300)
+    return fig
 
 
-def cap_pairs(data):
-    """Calculate differences of CAP pairs."""
-    cap = data.load("cap")
-    diffs = pd.DataFrame()
-    for i in range(4):
-        first = 2 * i + 1
-        second = first + 1
-        occ_diff = cap[f"occ_cap_0{first}"] - cap[f"occ_cap_0{second}"]
-        occ_diff.name = f"occ_cap_0{first}_0{second}"
-        dur_diff = cap[f"dur_cap_0{first}"] - cap[f"dur_cap_0{second}"]
-        dur_diff.name = f"dur_cap_0{first}_0{second}"
-        diffs = pd.concat([diffs, occ_diff, dur_diff], axis=1)
-        diffs.index.name = "participant_id"
-    return diffs.reindex(sorted(diffs.columns), axis=1)
-
-
-def _cca(X, Y):
-    ux, sx, vx = np.linalg.svd(X, 0)
-    uy, sy, vy = np.linalg.svd(Y, 0)
-    u, s, v = np.linalg.svd(ux.T.dot(uy), 0)
-    a = (vx.T).dot(u)
-    b = (vy.T).dot(v.T)
-    return a, b, s
-
-
-def plot_cca_weight(a, index, title):
+def print_cca_ci(X, Y, s, n_boot=1000):
+    """Bootstrap 95% confidence interval of the canonical correlations."""
+    _, _, s_boot = bootstrap_cca(X, Y, n_boot=n_boot, seed=42, workers=None)
+    ci = np.percentile(s_boot, [2.5, 97.5], axis=0)
+    for i, (low, high) in enumerate(ci.T):
+        print(f"Mode {i + 1}: r = {s[i]:.2f}, 95% CI [{low:.2f}, {high:.2f}]")
+
+
+def plot_varexp(s, title):
+    fig = plt.figure()
+    plt.plot(100 * s ** 2 / sum(s ** 2), "-o")
+    plt.title(title)
+    plt.xlabel("Canonical mode")
+    plt.ylabel("%")
+    return fig
+
+
+def plot_cca_weight(a, index, title, figsize=None):
     # plotting
+    fig = plt.figure(figsize=figsize)
     w = pd.DataFrame(a, index=index, columns=range(1, 9))
     sns.heatmap(w, square=True, center=0)
     plt.title(title)
     plt.xlabel("Canoncial mode")
+    return fig
 
 
 def plot_cca_score(U, V, s):
-    plt.figure(figsize=(9, 6))
+    fig = plt.figure(figsize=(9, 6))
     N = len(s)
     for i in range(N):
         plt.subplot(221 + i)
@@ -123,89 +145,102 @@ def plot_cca_score(U, V, s):
         plt.title("Mode %i (corr = %.2f)" % (i + 1, s[i]))
         plt.xticks(())
         plt.yticks(())
+    return fig
 
 
-def plot_cca_cap(data, basepath="results/descriptive"):
-    occ = data.load("occ").apply(zscore)
-    dur = data.load("dur").apply(zscore)
-
-    w_occ, w_dur, s = _cca(X=occ.values, Y=dur.values)
-
-    plt.figure()
-    plt.plot(100 * s ** 2 / sum(s ** 2), "-o")
-    plt.title("CCA CAP occurence x duration variance expalined")
-    plt.xlabel("Canonical mode")
-    plt.ylabel("%")
-    plt.savefig(f"{basepath}/cca_varexp_occ-dur.png", dpi=300)
-    plt.close()
-
-    plt.figure(figsize=(13, 7))
-    plot_cca_weight(w_occ, [f"occ-{i + 1}" for i in range(8)], "occ")
-    plt.savefig(f"{basepath}/cca_weight_cap-occ.png", dpi=300)
-    plt.tight_layout()
-    plt.close()
+def cca_cap_jobs(data, basepath="results/descriptive"):
+    occ = data.load("occ", transform="zscore")
+    dur = data.load("dur", transform="zscore")
 
-    plt.figure()
-    plot_cca_weight(w_dur, [f"dur-{i + 1}" for i in range(8)], "dur")
-    plt.savefig(f"{basepath}/cca_weight_cap-dur.png", dpi=300)
-    plt.close()
-
-    plot_cca_score(
-        occ.values.dot(w_occ[:, 0:4]),
-        dur.values.dot(w_dur[:, 0:4]),
-        s[0:4],
-    )
-    plt.savefig(f"{basepath}/cca_score_cap.png", dpi=300)
-    plt.close()
+    w_occ, w_dur, s = cca(occ.values, dur.values)
+    print_cca_ci(occ.values, dur.values, s)
 
     for i in range(8):
         print(pearsonr(w_occ[:, i], w_dur[:, i]))
         print(pearsonr(w_occ[:, i], w_dur[:, i]))
 
+    return [
+        figure_job(
+            f"{basepath}/cca_varexp_occ-dur.png",
+            plot_varexp,
+            s,
+            "CCA CAP occurence x duration variance expalined",
+        ),
+        figure_job(
+            f"{basepath}/cca_weight_cap-occ.png",
+            plot_cca_weight,
+            w_occ,
+            [f"occ-{i + 1}" for i in range(8)],
+            "occ",
+            figsize=(13, 7),
+        ),
+        figure_job(
+            f"{basepath}/cca_weight_cap-dur.png",
+            plot_cca_weight,
+            w_dur,
+            [f"dur-{i + 1}" for i in range(8)],
+            "dur",
+        ),
+        figure_job(
+            f"{basepath}/cca_score_cap.png",
+            plot_cca_score,
+            occ.values.dot(w_occ[:, 0:4]),
+            dur.values.dot(w_dur[:, 0:4]),
+            s[0:4],
+        ),
+    ]
+
 
-def plot_cca(data, basepath="results/descriptive"):
-    occ = data.load("occ").apply(zscore)
-    dur = data.load("dur").apply(zscore)
-    mriq = data.load("mriq_").apply(zscore)
+def cca_jobs(data, basepath="results/descriptive"):
+    occ = data.load("occ", transform="zscore")
+    dur = data.load("dur", transform="zscore")
+    mriq = data.load("mriq_", transform="zscore")
     mriq_labels = mriq.columns.tolist()
 
     cca_w_cap = []
     cca_w_mriq = []
+    jobs = []
     for cap, name in zip([occ, dur], ["occ", "dur"]):
-        w_mriq, w_cap, s = _cca(X=mriq.values, Y=cap.values)
+        w_mriq, w_cap, s = cca(mriq.values, cap.values)
+        print_cca_ci(mriq.values, cap.values, s)
         cca_w_cap.append(w_cap)
         cca_w_mriq.append(w_mriq)
 
-        plt.figure()
-        plt.plot(100 * s ** 2 / sum(s ** 2), "-o")
-        plt.title(f"CCA mriq x {name} variance expalined")
-        plt.xlabel("Canonical mode")
-        plt.ylabel("%")
-        plt.savefig(f"{basepath}/cca_varexp_mriq-{name}.png", dpi=300)
-        plt.close()
-
-        plt.figure(figsize=(13, 7))
-        plot_cca_weight(w_mriq, mriq_labels, "mriq")
-        plt.savefig(f"{basepath}/cca_weight_{name}-mriq.png", dpi=300)
-        plt.tight_layout()
-        plt.close()
-
-        plt.figure()
-        plot_cca_weight(w_cap, [f"{name}-{i + 1}" for i in range(8)], name)
-        plt.savefig(f"{basepath}/cca_weight_{name}-cap.png", dpi=300)
-        plt.close()
-
-        plot_cca_score(
-            mriq.values.dot(w_mriq[:, 0:4]),
-            cap.values.dot(w_cap[:, 0:4]),
-            s[0:4],
-        )
-        plt.savefig(f"{basepath}/cca_score_{name}.png", dpi=300)
-        plt.close()
+        jobs += [
+            figure_job(
+                f"{basepath}/cca_varexp_mriq-{name}.png",
+                plot_varexp,
+                s,
+                f"CCA mriq x {name} variance expalined",
+            ),
+            figure_job(
+                f"{basepath}/cca_weight_{name}-mriq.png",
+                plot_cca_weight,
+                w_mriq,
+                mriq_labels,
+                "mriq",
+                figsize=(13, 7),
+            ),
+            figure_job(
+                f"{basepath}/cca_weight_{name}-cap.png",
+                plot_cca_weight,
+                w_cap,
+                [f"{name}-{i + 1}" for i in range(8)],
+                name,
+            ),
+            figure_job(
+                f"{basepath}/cca_score_{name}.png",
+                plot_cca_score,
+                mriq.values.dot(w_mriq[:, 0:4]),
+                cap.values.dot(w_cap[:, 0:4]),
+                s[0:4],
+            ),
+        ]
 
     for i in range(8):
         print(pearsonr(cca_w_cap[0][:, i], cca_w_cap[1][:, i]))
         print(pearsonr(cca_w_mriq[0][:, i], cca_w_mriq[1][:, i]))
+    return jobs
 
 
 if __name__ == "__main__":
@@ -220,12 +255,20 @@ if __name__ == "__main__":
         mriq_labeltype="full",
         mriq_drop=None,
     )
-    diff = cap_pairs(data)
+    diff = data.contrast("pairs")
     cap = data.load("cap")
     mriq = data.load("mriq_")
-    plot_occ_dur(data, basepath)
-    plot_demo(data, basepath)
-    plot_corr(cap, mriq, "cap-raw", basepath)
-    plot_corr(diff, mriq, "cap-pairs", basepath)
-    # plot_cca(data, basepath)
-    # plot_cca_cap(data, basepath)
+    mriq_rank = data.load("mriq_", transform="rank")
+    cap_rank = data.load("cap", transform="rank")
+    jobs = [
+        figure_job(f"{basepath}/occ_dur.png", plot_occ_dur, cap),
+        figure_job(f"{basepath}/demographic.png", plot_demo, data.load()),
+    ]
+    jobs += corr_jobs(cap, mriq, "cap-raw", basepath, 10000, (cap_rank, mriq_rank))
+    jobs += corr_jobs(
+        diff, mriq, "cap-pairs", basepath, 10000, (diff.rank(), mriq_rank)
+    )
+    # jobs += cca_jobs(data, basepath)
+    # jobs += cca_cap_jobs(data, basepath)
+    # figures with unchanged data and code are not drawn again
+    print(run_figures(jobs, f"{basepath}/figures.json", workers=None))
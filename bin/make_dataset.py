@@ -2,16 +2,21 @@
 Get CAP data and MRIQ of the current sample.
 Only need to be ran once for tidying things up, but keep it here for book keeping.
 """
-import json
 import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
 import numpy as np
 import pandas as pd
 from scipy import io
 
 from nkicap import get_project_path, read_tsv
+from nkicap.manifest import Manifest
+from nkicap.utils import bounded_map, create_cap_store
 
 SOURCE_MAT = "sourcedata/CAP_results_organized_toHaoTing.mat"
+SOURCE_MAT_V73 = "sourcedata/CAP_results_organized_toHaoTing_v73.mat"
 SOURCE_MRIQ = "sourcedata/ses-BAS1_mriq.csv"
 PARTICIPANTS = "enhanced_nki/participants.tsv"
 MRIQ = "enhanced_nki/mriq.tsv"
@@ -21,8 +26,17 @@ TIAN = "parcellations/Tian_Subcortex_S4_3T_label.txt"
 CAP_OCC = "enhanced_nki/desc-cap_occurence.tsv"
 CAP_DUR = "enhanced_nki/desc-cap_duration.tsv"
 CAP_GROUP = "enhanced_nki/desc-cap_groupmap.tsv"
+CAP_STORE = "enhanced_nki/desc-capmap_bold.npy"
+TRANSITION_STORE = "enhanced_nki/desc-transition.npy"
 CAP_ROI = "enhanced_nki/desg.tsv"
 
+# fields of the source struct small enough to be read whole
+SOURCE_FIELDS = ("subjects", "occurence_rate", "duration", "map_group", "age", "sex")
+# fields holding one cell per subject, streamed from v7.3 files
+SUBJECT_FIELDS = ("transition", "map_sub")
+# MAT-file header of the HDF5 user block: text, version 0x0200, endian indicator
+MAT73_HEADER = b"MATLAB 7.3 MAT-file".ljust(116) + bytes(8) + b"\x00\x02IM"
+
 data_dir = get_project_path() / "data"
 
 
@@ -41,11 +55,189 @@ def roi_labels():
     lablel.to_csv(data_dir / LABEL, index=False, sep="\t")
 
 
-def source2raw():
-    """Parse .mat file to txt."""
-    cap_results = io.loadmat(
-        data_dir / SOURCE_MAT, squeeze_me=True, simplify_cells=True
-    )["CAP_results"]
+def _export_subject(sub, transit, capmap):
+    """Save transition matrix and CAP map of one subject."""
+    cap_labels = [f"cap_{i+1:02d}" for i in range(8)]
+    # create subject dir
+    sub_path = f"enhanced_nki/sub-{sub}/"
+    if not (data_dir / sub_path).exists():
+        os.makedirs(str(data_dir / sub_path))
+    transit = pd.DataFrame(transit, index=cap_labels, columns=cap_labels)
+    capmap = pd.DataFrame(capmap, columns=cap_labels, index=range(1, 1055))
+    transit.to_csv(
+        data_dir / f"enhanced_nki/sub-{sub}/sub-{sub}_desc-transition.tsv",
+        sep="\t",
+    )
+    capmap.to_csv(
+        data_dir / f"enhanced_nki/sub-{sub}/sub-{sub}_desc-capmap_bold.tsv",
+        sep="\t",
+    )
+
+
+def _read_hdf5(f, obj):
+    """Read a MATLAB v7.3 variable, in MATLAB's axis order."""
+    import h5py
+
+    if obj.dtype == h5py.ref_dtype:
+        # cell array
+        return [_read_hdf5(f, f[ref]) for ref in obj[()].ravel()]
+    value = obj[()].T
+    matlab_class = obj.attrs.get("MATLAB_class", b"")
+    if isinstance(matlab_class, bytes):
+        matlab_class = matlab_class.decode()
+    if matlab_class == "char":
+        return "".join(map(chr, value.ravel()))
+    return value.squeeze()
+
+
+def _write_hdf5(group, name, value, refs):
+    """Write a variable in the MATLAB v7.3 layout, transposed, cells as refs."""
+    import h5py
+
+    if isinstance(value, str):
+        data = np.array([[ord(c)] for c in value], dtype=np.uint16)
+        matlab_class = "char"
+    elif isinstance(value, list) or (
+        isinstance(value, np.ndarray) and value.dtype == object
+    ):
+        cells = [
+            _write_hdf5(refs, f"{name}_{i}", item, refs).ref
+            for i, item in enumerate(value)
+        ]
+        data = np.array([cells], dtype=h5py.ref_dtype).T
+        matlab_class = "cell"
+    else:
+        data = np.asarray(value, dtype=float).T
+        matlab_class = "double"
+    dset = group.create_dataset(name, data=data)
+    dset.attrs["MATLAB_class"] = np.bytes_(matlab_class)
+    return dset
+
+
+def convert_source(path, dest):
+    """
+    Convert a source .mat file saved before v7.3 to the v7.3 format.
+
+    The source is loaded whole, once; the converted file is then streamed
+    by `open_source` one subject at a time. Requires h5py.
+    """
+    import h5py
+
+    cap_results = io.loadmat(path, squeeze_me=True, simplify_cells=True)["CAP_results"]
+    with h5py.File(dest, "w", userblock_size=512) as f:
+        refs = f.create_group("#refs#")
+        struct = f.create_group("CAP_results")
+        for key in SOURCE_FIELDS + SUBJECT_FIELDS:
+            _write_hdf5(struct, key, cap_results[key], refs)
+    with open(dest, "r+b") as f:
+        f.write(MAT73_HEADER)
+    return dest
+
+
+def _source_path():
+    """The source .mat file, converted once to v7.3 when h5py is installed."""
+    source = data_dir / SOURCE_MAT
+    try:
+        import h5py
+    except ImportError:
+        return source
+    if h5py.is_hdf5(source):
+        return source
+    converted = data_dir / SOURCE_MAT_V73
+    if not converted.exists() or converted.stat().st_mtime < source.stat().st_mtime:
+        convert_source(source, converted)
+    return converted
+
+
+@contextmanager
+def open_source(path):
+    """
+    Open the source .mat file.
+
+    Yields the fields in `SOURCE_FIELDS` and an iterator of the
+    (subject, transition matrix, CAP map) of each subject.
+    MATLAB v7.3 files are HDF5 and the subjects are read one at a time
+    with h5py, install it with `pip install nkicap[matlab]`. Older versions
+    can only be loaded whole with scipy; convert them once with
+    `convert_source`, or save them with `-v7.3`, to stream large cohorts.
+    """
+    try:
+        import h5py
+    except ImportError:
+        h5py = None
+
+    if h5py is None or not h5py.is_hdf5(path):
+        try:
+            cap_results = io.loadmat(path, squeeze_me=True, simplify_cells=True)[
+                "CAP_results"
+            ]
+        except NotImplementedError as err:
+            # scipy does not read v7.3 files
+            raise ImportError(
+                "Reading MATLAB v7.3 files requires h5py, install it with "
+                "`pip install nkicap[matlab]`."
+            ) from err
+        warnings.warn(
+            f"{path} is loaded whole, convert it to v7.3 with `convert_source` "
+            "to stream the subjects."
+        )
+        yield cap_results, zip(
+            cap_results["subjects"], cap_results["transition"], cap_results["map_sub"]
+        )
+        return
+
+    with h5py.File(path, "r") as f:
+        cap_results = f["CAP_results"]
+        fields = {key: _read_hdf5(f, cap_results[key]) for key in SOURCE_FIELDS}
+
+        def subjects():
+            cells = zip(*(cap_results[key][()].ravel() for key in SUBJECT_FIELDS))
+            for sub, (transit, capmap) in zip(fields["subjects"], cells):
+                yield sub, _read_hdf5(f, f[transit]), _read_hdf5(f, f[capmap])
+
+        yield fields, subjects()
+
+
+def _stream_subjects(subjects, store, transitions):
+    """Write each subject into the stores, passing the subjects through."""
+    for i, (sub, transit, capmap) in enumerate(subjects):
+        store[i] = capmap
+        transitions[i] = transit
+        yield sub, transit, capmap
+
+
+def source2raw(workers=1):
+    """Parse .mat file to txt.
+
+    Subjects are streamed from the source into their files and the CAP map
+    store, so memory use does not grow with the cohort. Sources older than
+    v7.3 are converted once first, with h5py installed.
+    `workers` sets the number of processes exporting the subject files;
+    None uses all cores.
+    """
+    cap_labels = [f"cap_{i+1:02d}" for i in range(8)]
+    with open_source(_source_path()) as (cap_results, subjects):
+        # cap map and transition matrix, each subject is written to its files
+        # and to the memory mapped stores of all subjects
+        store = create_cap_store(
+            data_dir / CAP_STORE, cap_results["subjects"], range(1, 1055), cap_labels
+        )
+        transitions = create_cap_store(
+            data_dir / TRANSITION_STORE, cap_results["subjects"], cap_labels, cap_labels
+        )
+        subjects = _stream_subjects(subjects, store, transitions)
+        if workers == 1:
+            for args in subjects:
+                _export_subject(*args)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                max_pending = 2 * (workers or os.cpu_count())
+                # consume the iterator so errors in the workers are raised here
+                list(bounded_map(executor, _export_subject, subjects, max_pending))
+        store.flush()
+        transitions.flush()
+        del store, transitions
+
     mriq_source = pd.read_csv(data_dir / SOURCE_MRIQ, index_col=0).dropna()
     mriq_source["mriq"] = np.ones(mriq_source.shape[0])
 
@@ -66,28 +258,6 @@ def source2raw():
     dur.index.name = "participant_id"
     dur.to_csv(data_dir / CAP_DUR, sep="\t")
 
-    # cap map and transition matrix
-    cap_labels = [f"cap_{i+1:02d}" for i in range(8)]
-    for transit, capmap, sub in zip(
-        cap_results["transition"],
-        cap_results["map_sub"],
-        cap_results["subjects"],
-    ):
-        # create subject dir
-        sub_path = f"enhanced_nki/sub-{sub}/"
-        if not (data_dir / sub_path).exists():
-            os.makedirs(str(data_dir / sub_path))
-        transit = pd.DataFrame(transit, index=cap_labels, columns=cap_labels)
-        capmap = pd.DataFrame(capmap, columns=cap_labels, index=range(1, 1055))
-        transit.to_csv(
-            data_dir / f"enhanced_nki/sub-{sub}/sub-{sub}_desc-transition.tsv",
-            sep="\t",
-        )
-        capmap.to_csv(
-            data_dir / f"enhanced_nki/sub-{sub}/sub-{sub}_desc-capmap_bold.tsv",
-            sep="\t",
-        )
-
     cap_group = pd.DataFrame(
         cap_results["map_group"], columns=cap_labels, index=range(1, 1055)
     )
@@ -137,6 +307,7 @@ def fetch_dataset():
 
     dataset = {
         "group": f"data/{CAP_GROUP}",
+        "store": f"data/{CAP_STORE}",
         "subject": {},
         "roi": roi.values.squeeze().tolist(),
     }
@@ -147,13 +318,13 @@ def fetch_dataset():
 
 
 if __name__ == "__main__":
-    source2raw()
+    source2raw(workers=None)
     roi_labels()
     dataset, master = fetch_dataset()
     master.to_csv(get_project_path() / "data" / "enhanced_nki.tsv", sep="\t")
 
-    with open(get_project_path() / "data" / "cap.json", "w") as fp:
-        json.dump(dataset, fp, indent=2)
+    # record sizes, hashes, shapes and modification times of the files
+    Manifest(dataset).record().save(get_project_path() / "data" / "cap.json")
 
 
 def test_fetch_dataset():
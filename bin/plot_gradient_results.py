@@ -2,13 +2,10 @@ from pathlib import Path
 
 import matplotlib.pyplot as plt
 
+from nkicap.figures import figure_job, run_figures
 from nkicap.gradient import cap_to_gradient
 from nkicap.utils import get_project_path
 
-gradient_space = cap_to_gradient(
-    Path(get_project_path()) / "data/cap_gradient_space.tsv"
-)
-
 cap_color = {
     1: "yellowgreen",
     2: "forestgreen",
@@ -21,7 +18,7 @@ cap_color = {
 }
 
 
-def plot_caps(x_label, ylabel, cap_range):
+def plot_caps(gradient_space, x_label, ylabel, cap_range):
     sub = gradient_space["participant_id"] != "group"
     scatter = []
     fig = plt.figure()
@@ -48,8 +45,27 @@ def plot_caps(x_label, ylabel, cap_range):
 
 
 if __name__ == "__main__":
-    group_1 = plot_caps("Gradient 1", "Gradient 2", range(1, 5))
-    group_2 = plot_caps("Gradient 1", "Gradient 3", range(5, 9))
-
-    group_1.savefig("results/gradient_space_cap_1-4.png")
-    group_2.savefig("results/gradient_space_cap_5-8.png")
+    gradient_space = cap_to_gradient(
+        Path(get_project_path()) / "data/cap_gradient_space.tsv"
+    )
+    jobs = [
+        figure_job(
+            "results/gradient_space_cap_1-4.png",
+            plot_caps,
+            gradient_space,
+            "Gradient 1",
+            "Gradient 2",
+            range(1, 5),
+            dpi=100,
+        ),
+        figure_job(
+            "results/gradient_space_cap_5-8.png",
+            plot_caps,
+            gradient_space,
+            "Gradient 1",
+            "Gradient 3",
+            range(5, 9),
+            dpi=100,
+        ),
+    ]
+    print(run_figures(jobs, "results/gradient_figures.json", workers=None))
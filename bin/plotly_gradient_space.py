@@ -8,9 +8,12 @@ import plotly.express as px
 from dash.dependencies import Input, Output
 from jupyter_dash import JupyterDash
 
-from nkicap.gradient import cap_to_gradient
+from nkicap.gradient import GradientSpaceIndex, cap_to_gradient
 from nkicap.utils import get_project_path
 
+# subject points per CAP sent to the browser by default
+MAX_POINTS = 200
+
 gradient_space = cap_to_gradient(
     Path(get_project_path()) / "data/cap_gradient_space.tsv"
 )
@@ -19,6 +22,7 @@ gradient_space["type"] = None
 mask_group = gradient_space["participant_id"] == "group"
 gradient_space.loc[mask_group, "type"] = "group"
 gradient_space.loc[~mask_group, "type"] = "sub"
+index = GradientSpaceIndex(gradient_space)
 
 
 app = JupyterDash(__name__)
@@ -32,19 +36,53 @@ app.layout = html.Div(
             value=["1", "2"],
             labelStyle={"display": "inline-block"},
         ),
+        html.P("View"),
+        dcc.RadioItems(
+            id="view",
+            options=[
+                {"label": "points", "value": "points"},
+                {"label": "density", "value": "density"},
+            ],
+            value="points",
+            labelStyle={"display": "inline-block"},
+        ),
+        html.P("Subjects per CAP"),
+        dcc.Slider(
+            id="max-points",
+            min=50,
+            max=max(len(sub) for sub in index.subjects.values()),
+            step=50,
+            value=MAX_POINTS,
+        ),
     ]
 )
 
 
-@app.callback(Output("gradient-space", "figure"), [Input("cap-label", "value")])
-def update_chart(value):
-    mask = []
-    for i in value:
-        cap = gradient_space[gradient_space["CAP"] == int(i)]
-        mask.extend(cap.index.tolist())
+@app.callback(
+    Output("gradient-space", "figure"),
+    [Input("cap-label", "value"), Input("view", "value"), Input("max-points", "value")],
+)
+def update_chart(value, view, max_points):
+    if view == "density":
+        # one marker per non-empty bin, sized by the number of subjects
+        return px.scatter_3d(
+            index.density(value),
+            x="Gradient 1",
+            y="Gradient 2",
+            z="Gradient 3",
+            range_x=[-1, 1],
+            range_y=[-1, 1],
+            range_z=[-1, 1],
+            range_color=[1, 8],
+            size="count",
+            color="CAP",
+            opacity=0.5,
+            width=800,
+            height=500,
+        )
 
     fig = px.scatter_3d(
-        gradient_space.iloc[mask, 1:],
+        index.select(value, max_points).iloc[:, 1:],
         x="Gradient 1",
         y="Gradient 2",
         z="Gradient 3",
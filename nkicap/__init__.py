@@ -3,12 +3,16 @@ Data analysis suit of the CAP project
 -------------------------------------
 
 """
-from .utils import Data, get_project_path, read_tsv
+from .manifest import Manifest
+from .utils import CAPStore, Data, get_project_path, read_tsv, save_cap_store
 
 __all__ = [
     Data,
     read_tsv,
     get_project_path,
+    CAPStore,
+    save_cap_store,
+    Manifest,
     "plotting",
     "__version__",
 ]  # not allowing scripts to be read
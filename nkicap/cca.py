@@ -0,0 +1,181 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from .stats import _run_chunks
+
+
+def _swap(x):
+    """Transpose the last two axes of a stack of matrices."""
+    return np.swapaxes(x, -1, -2)
+
+
+def _center(x):
+    """Centre the columns of a matrix or of a stack of matrices."""
+    return x - x.mean(axis=-2, keepdims=True)
+
+
+def cca(X, Y):
+    """
+    Canonical correlation analysis through the SVD of each data matrix.
+
+    Works on a single pair of matrices or on stacks of them, in which case
+    all the SVDs are batched. The columns of each matrix are centred first.
+
+    Parameters
+    ----------
+    X : numpy.ndarray, shape (..., n_subjects, p)
+
+    Y : numpy.ndarray, shape (..., n_subjects, q)
+
+    Returns
+    -------
+    a : numpy.ndarray, shape (..., p, k)
+        Weights of X.
+
+    b : numpy.ndarray, shape (..., q, k)
+        Weights of Y.
+
+    s : numpy.ndarray, shape (..., k)
+        Canonical correlations, k = min(p, q).
+    """
+    ux, _, vx = np.linalg.svd(_center(X), full_matrices=False)
+    uy, _, vy = np.linalg.svd(_center(Y), full_matrices=False)
+    return _cca_from_bases(ux, vx, uy, vy)
+
+
+def _cca_from_bases(ux, vx, uy, vy):
+    """CCA from the left and right singular vectors of X and Y."""
+    u, s, v = np.linalg.svd(_swap(ux) @ uy, full_matrices=False)
+    a = _swap(vx) @ u
+    b = _swap(vy) @ _swap(v)
+    return a, b, s
+
+
+def _align(a, b, s, a_ref, b_ref):
+    """
+    Match the order and sign of resampled modes to the reference modes.
+
+    Modes are paired by the absolute similarity of their weights, then
+    flipped when they point away from the reference.
+    """
+    k = a_ref.shape[-1]
+    for i in range(a.shape[0]):
+        similarity = _swap(a[i]) @ a_ref + _swap(b[i]) @ b_ref
+        _, order = linear_sum_assignment(-np.abs(similarity).T)
+        sign = np.sign(similarity[order, np.arange(k)])
+        sign[sign == 0] = 1
+        a[i] = a[i][:, order] * sign
+        b[i] = b[i][:, order] * sign
+        s[i] = s[i][order]
+    return a, b, s
+
+
+def _bootstrap_chunk(X, Y, a_ref, b_ref, seed, n_boot):
+    """CCA of one chunk of bootstrap resamples."""
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, X.shape[0], size=(n_boot, X.shape[0]))
+    # cca centres each resample
+    a, b, s = cca(X[idx], Y[idx])
+    return _align(a, b, s, a_ref, b_ref)
+
+
+def bootstrap_cca(X, Y, n_boot=1000, seed=None, chunk_size=100, workers=1):
+    """
+    Bootstrap distribution of the canonical correlations and weights.
+
+    Subjects are resampled with replacement and all resamples of a chunk
+    are fitted with stacked SVDs. Weights of each resample are matched in
+    order and sign to the weights of the full sample.
+
+    Parameters
+    ----------
+    X : numpy.ndarray, shape (n_subjects, p)
+
+    Y : numpy.ndarray, shape (n_subjects, q)
+
+    n_boot : int, optional
+        Number of bootstrap resamples.
+
+    seed : int, optional
+        Seed of the resampling. For a given seed and `chunk_size`, results
+        do not depend on `workers`.
+
+    chunk_size : int, optional
+        Number of resamples fitted in one batch.
+
+    workers : int or None, optional
+        Number of processes. None uses all cores.
+
+    Returns
+    -------
+    a : numpy.ndarray, shape (n_boot, p, k)
+        Aligned weights of X.
+
+    b : numpy.ndarray, shape (n_boot, q, k)
+        Aligned weights of Y.
+
+    s : numpy.ndarray, shape (n_boot, k)
+        Canonical correlations, in the order of the aligned modes.
+
+    Example
+    -------
+    >> a, b, s = bootstrap_cca(mriq.values, occ.values, n_boot=5000, seed=42)
+    >> np.percentile(s, [2.5, 97.5], axis=0)  # 95% CI of each mode
+    """
+    X, Y = np.asarray(X, dtype=float), np.asarray(Y, dtype=float)
+    a_ref, b_ref, _ = cca(X, Y)
+    results = _run_chunks(
+        _bootstrap_chunk, (X, Y, a_ref, b_ref), n_boot, chunk_size, seed, workers
+    )
+    a, b, s = (np.concatenate(res) for res in zip(*results))
+    return a, b, s
+
+
+def _permutation_chunk(ux, uy, seed, n_perm):
+    """Canonical correlations of one chunk of row permutations of Y."""
+    rng = np.random.default_rng(seed)
+    perm = rng.permuted(np.tile(np.arange(uy.shape[0]), (n_perm, 1)), axis=1)
+    # permuting the rows of Y permutes the rows of its left singular vectors
+    return np.linalg.svd(ux.T @ uy[perm], compute_uv=False)
+
+
+def permutation_cca(X, Y, n_perm=1000, seed=None, chunk_size=100, workers=1):
+    """
+    Permutation test of the canonical correlations.
+
+    Rows of Y are permuted. The SVD of X and Y is computed once; each
+    permutation then only needs the SVD of a small k x k cross product.
+
+    Parameters
+    ----------
+    X : numpy.ndarray, shape (n_subjects, p)
+
+    Y : numpy.ndarray, shape (n_subjects, q)
+
+    n_perm : int, optional
+        Number of permutations.
+
+    seed, chunk_size, workers : optional
+        See `bootstrap_cca`.
+
+    Returns
+    -------
+    s : numpy.ndarray, shape (k,)
+        Canonical correlations.
+
+    p_values : numpy.ndarray, shape (k,)
+        p-value of each mode against the null distribution of the mode of
+        the same rank.
+
+    null : numpy.ndarray, shape (n_perm, k)
+        Canonical correlations of the permuted data.
+    """
+    X, Y = _center(np.asarray(X, dtype=float)), _center(np.asarray(Y, dtype=float))
+    ux, _, vx = np.linalg.svd(X, full_matrices=False)
+    uy, _, vy = np.linalg.svd(Y, full_matrices=False)
+    _, _, s = _cca_from_bases(ux, vx, uy, vy)
+    null = np.concatenate(
+        _run_chunks(_permutation_chunk, (ux, uy), n_perm, chunk_size, seed, workers)
+    )
+    p_values = ((null >= s).sum(axis=0) + 1) / (n_perm + 1)
+    return s, p_values, null
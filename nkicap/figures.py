@@ -0,0 +1,209 @@
+"""Render figures headless in parallel, skipping the unchanged ones."""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def figure_job(path, func, *args, dpi=300, **kwargs):
+    """
+    Declare a figure: `func(*args, **kwargs)` draws it, saved to `path`.
+
+    `func` must be importable by the worker processes, and returns the
+    matplotlib Figure or draws on the current figure.
+
+    Parameters
+    ----------
+    path : str or Path
+        Output file, the format follows the extension.
+
+    func : callable
+        Plotting function.
+
+    *args, **kwargs
+        Data and options passed to `func`.
+
+    dpi : int, optional
+        Resolution passed to savefig.
+
+    Returns
+    -------
+    dict
+    """
+    return {
+        "path": str(path),
+        "func": func,
+        "args": args,
+        "kwargs": kwargs,
+        "savefig": {"dpi": dpi},
+    }
+
+
+def _update_hash(sha, obj):
+    """Hash data by content, pandas and numpy objects included."""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        sha.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+        names = obj.columns if isinstance(obj, pd.DataFrame) else [obj.name]
+        sha.update(repr(list(names)).encode())
+    elif isinstance(obj, np.ndarray):
+        sha.update(repr((obj.shape, obj.dtype.str)).encode())
+        sha.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        sha.update(f"{type(obj).__name__}{len(obj)}".encode())
+        for item in obj:
+            _update_hash(sha, item)
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=repr):
+            _update_hash(sha, key)
+            _update_hash(sha, obj[key])
+    else:
+        sha.update(pickle.dumps(obj))
+
+
+def _func_source(func):
+    """Source code of the plotting function, or its bytecode without a source."""
+    try:
+        return inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        return func.__code__.co_code
+
+
+@functools.lru_cache(maxsize=None)
+def _read_source(path, mtime):
+    return Path(path).read_bytes()
+
+
+def _source(path):
+    """Content of a source file, read again only when it changed."""
+    return _read_source(str(path), os.stat(path).st_mtime)
+
+
+def _code_files(func):
+    """Files of the module defining the plotting function and of nkicap."""
+    files = sorted(Path(__file__).parent.glob("*.py"))
+    module_file = getattr(inspect.getmodule(func), "__file__", None)
+    if module_file is not None and Path(module_file).exists():
+        files.insert(0, Path(module_file))
+    return files
+
+
+def job_key(job):
+    """
+    Content address of a figure: its data, options and plotting code.
+
+    The code covers the source of the plotting function, of the module
+    defining it, so helpers next to it, and of the nkicap package.
+    """
+    sha = hashlib.sha256(_func_source(job["func"]))
+    for path in _code_files(job["func"]):
+        sha.update(_source(path))
+    _update_hash(sha, [job["args"], job["kwargs"], job["savefig"]])
+    return sha.hexdigest()
+
+
+def _init_agg():
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def _render(func, args, kwargs, path, savefig):
+    """Draw and save one figure."""
+    import matplotlib.pyplot as plt
+    from matplotlib.figure import Figure
+
+    fig = func(*args, **kwargs)
+    if not isinstance(fig, Figure):
+        fig = plt.gcf()
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(path, **savefig)
+    plt.close(fig)
+    return os.stat(path).st_size
+
+
+def run_figures(jobs, manifest, workers=1, force=False):
+    """
+    Render figure jobs, skipping those whose inputs and code are unchanged.
+
+    Figures are drawn on the Agg backend in worker processes. A job is
+    skipped when its output exists and its key, from `job_key`, matches
+    the one recorded in the manifest.
+
+    Parameters
+    ----------
+    jobs : list of dict
+        Figures from `figure_job`.
+
+    manifest : str or Path
+        JSON file recording the key, plotting function and size of each
+        output, updated after the run.
+
+    workers : int or None, optional
+        Number of processes. 1 renders in this process, on the Agg backend
+        until done; None uses all cores.
+
+    force : bool, optional
+        Render all figures.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The "status" ("rendered" or "skipped") and "key" of each output,
+        indexed by path.
+    """
+    manifest = Path(manifest)
+    records = {}
+    if manifest.exists():
+        records = json.loads(manifest.read_text())
+
+    keys = [job_key(job) for job in jobs]
+    todo = [
+        (job, key)
+        for job, key in zip(jobs, keys)
+        if force
+        or records.get(job["path"], {}).get("key") != key
+        or not Path(job["path"]).exists()
+    ]
+    tasks = [
+        [job[field] for job, _ in todo]
+        for field in ["func", "args", "kwargs", "path", "savefig"]
+    ]
+    if workers == 1:
+        import matplotlib.pyplot as plt
+
+        backend = plt.get_backend()
+        plt.switch_backend("Agg")
+        try:
+            sizes = list(map(_render, *tasks))
+        finally:
+            plt.switch_backend(backend)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_agg) as pool:
+            sizes = list(pool.map(_render, *tasks))
+
+    for (job, key), size in zip(todo, sizes):
+        func = job["func"]
+        records[job["path"]] = {
+            "key": key,
+            "function": f"{func.__module__}.{func.__qualname__}",
+            "size": size,
+        }
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    manifest.write_text(json.dumps(records, indent=2, sort_keys=True))
+
+    rendered = {job["path"] for job, _ in todo}
+    paths = [job["path"] for job in jobs]
+    return pd.DataFrame(
+        {
+            "status": ["rendered" if p in rendered else "skipped" for p in paths],
+            "key": keys,
+        },
+        index=pd.Index(paths, name="path"),
+    )
@@ -1,64 +1,363 @@
+import hashlib
 import json
+import warnings
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
-from .utils import get_project_path, read_tsv
+from .manifest import Manifest, _hash_file, _read_cap_map
+from .utils import CAPStore, get_project_path, parallel_map, read_tsv
+
+N_GRADIENTS = 3
+GRADIENT_PATH = (
+    Path(get_project_path()) / "data/hcp/hcp_embed_1-10_Schaefer1000_7Networks.txt"
+)
 
 
 def _fetch_margulies_gradient():
     """Load Margulies gradients in Schaefer 100 space"""
-    path_dm_gradient = (
-        Path(get_project_path()) / "data/hcp/hcp_embed_1-10_Schaefer1000_7Networks.txt"
-    )
-    return read_tsv(path_dm_gradient, header=None, names=list(range(1, 11)))
+    return read_tsv(GRADIENT_PATH, header=None, names=list(range(1, 11)))
+
+
+def _standardize(x):
+    """Centre and scale to unit norm along the last axis."""
+    x = x - x.mean(axis=-1, keepdims=True)
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
 
 
-def map_space(cap_val):
+def map_space(cap_val, dm_gradient=None):
     """Calculate the correlation of CAP map and top 3 Margulies gradients."""
-    dm_gradient = _fetch_margulies_gradient()
+    if dm_gradient is None:
+        dm_gradient = _fetch_margulies_gradient()
 
     gs = []
-    for i in range(3):
+    for i in range(N_GRADIENTS):
         dm = dm_gradient[i + 1]
         gs.append(np.corrcoef(cap_val[:1000], dm)[0, 1])
     return tuple(gs)
 
 
-def cap_to_gradient(data_path=None):
-    """Map all cap map to gradient space on real data."""
-    if Path(data_path).exists:
-        return read_tsv(data_path)
-    # load data collection
-    path_cap_collection = Path(get_project_path()) / "data/cap.json"
-    with open(path_cap_collection) as json_file:
-        path_cap = json.load(json_file)
-
-    # load group cap and map to gradient space
-    path_group_cap = path_cap["group"]
-    group_cap = read_tsv(path_group_cap, index_col=0)
-    gradient_space = {
-        label: {"group": map_space(cap_val)} for label, cap_val in group_cap.items()
-    }
+def project_to_gradient(cap_maps, dm_gradient=None):
+    """
+    Correlate a stack of CAP maps with the top 3 Margulies gradients.
+
+    The gradients are loaded, centred and normalised once, so all correlations
+    are computed in a single matrix product.
+
+    Parameters
+    ----------
+    cap_maps : array-like, shape (n_maps, n_caps, n_roi)
+        CAP maps. Only the first 1000 (cortical) ROIs are used.
+
+    dm_gradient : pandas.DataFrame, optional
+        Preloaded gradients, one column per gradient, as returned by
+        `_fetch_margulies_gradient`.
+
+    Returns
+    -------
+    numpy.ndarray, shape (n_maps, n_caps, 3)
+        Pearson's correlation of each CAP map with each gradient.
+    """
+    if dm_gradient is None:
+        dm_gradient = _fetch_margulies_gradient()
+    gradients = np.asarray(dm_gradient, dtype=float)[:, :N_GRADIENTS]
+    n_cortex = gradients.shape[0]
+
+    cap_maps = np.asarray(cap_maps, dtype=float)[..., :n_cortex]
+    return _standardize(cap_maps) @ _standardize(gradients.T).T
+
+
+def batch_map_space(cap_maps, participant_id, cap_labels, dm_gradient=None):
+    """
+    Map stacked CAP maps to gradient space.
+
+    Parameters
+    ----------
+    cap_maps : array-like, shape (n_maps, n_caps, n_roi)
+        CAP maps of the group and/or subjects.
+
+    participant_id : list of str
+        Label of each map along the first axis, such as "group" or subject ID.
+
+    cap_labels : list of str
+        CAP names along the second axis, such as "cap_01".
 
-    # load subject cap and map to gradient space
-    for sub, path in path_cap["subject"].items():
-        sub_cap = read_tsv(path, index_col=0)
-        for label, cap_val in sub_cap.items():
-            gradient_space[label][sub] = map_space(cap_val)
+    dm_gradient : pandas.DataFrame, optional
+        Preloaded gradients. Loaded from the project data by default.
 
-    # covert to dataframe
+    Returns
+    -------
+    pandas.DataFrame
+        Long format table with the same layout as `cap_to_gradient`.
+    """
+    projection = project_to_gradient(cap_maps, dm_gradient)
     collect = []
-    for key in gradient_space:
+    for i, label in enumerate(cap_labels):
         df = pd.DataFrame(
-            gradient_space[key], index=[f"Gradient {i+1}" for i in range(3)]
-        ).T
-        df["CAP"] = key[-2:]
-        df.index.name = "participant_id"
-        df = df.reset_index()
+            projection[:, i, :],
+            columns=[f"Gradient {g + 1}" for g in range(N_GRADIENTS)],
+        )
+        df.insert(0, "participant_id", list(participant_id))
+        df["CAP"] = int(label[-2:])
         collect.append(df)
-    gradient_space = pd.concat(collect, axis=0)
-    if data_path:
-        gradient_space.to_csv(data_path, sep="\t", index=False)
+    return pd.concat(collect, axis=0, ignore_index=True)
+
+
+def load_cap_maps(paths, workers=1):
+    """
+    Load CAP map tsv files, optionally across a pool of processes.
+
+    Parameters
+    ----------
+    paths : list of str or Path
+        CAP map files, one per subject.
+
+    workers : int or None, optional
+        Number of processes. 1 loads the files serially; None uses all cores.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        One (cap, roi) array per file, in the order of `paths`.
+    """
+    return parallel_map(_read_cap_map, paths, workers=workers)
+
+
+def _cache_inputs(path_cap):
+    """Hash every input of the gradient space: gradients, group and subject maps."""
+    inputs = {
+        "gradient": _hash_file(GRADIENT_PATH),
+        "group": _hash_file(path_cap["group"]),
+    }
+    if path_cap.get("store"):
+        store = CAPStore(path_cap["store"])
+        inputs["subject"] = {
+            sub: hashlib.sha256(store.subject(sub).tobytes()).hexdigest()
+            for sub in path_cap["subject"]
+        }
+    else:
+        inputs["subject"] = {
+            sub: _hash_file(path) for sub, path in path_cap["subject"].items()
+        }
+    return inputs
+
+
+def _cache_key(inputs):
+    """Content address of the gradient space."""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def _compute_gradient_space(manifest, workers=1, subjects=None):
+    """Load group and subject cap, stacked as (map, cap, roi), and project."""
+    manifest.validate(subjects)
+    path_cap = manifest.resolved()
+    group_cap = read_tsv(path_cap["group"], index_col=0)
+    if subjects is None:
+        subjects = list(path_cap["subject"])
+    if path_cap.get("store"):
+        sub_caps = np.moveaxis(CAPStore(path_cap["store"]).select(subjects), 2, 1)
+    else:
+        paths = [path_cap["subject"][sub] for sub in subjects]
+        sub_caps = np.reshape(
+            load_cap_maps(paths, workers), (-1, *group_cap.shape[::-1])
+        )
+    cap_maps = np.concatenate([group_cap.values.T[np.newaxis], sub_caps])
+    return batch_map_space(cap_maps, ["group"] + subjects, group_cap.columns.tolist())
+
+
+def _merge_gradient_space(cached, update, subjects):
+    """Replace the updated rows of a cached gradient space, in cap.json order."""
+    keep = ~cached["participant_id"].isin(update["participant_id"]) & cached[
+        "participant_id"
+    ].isin(subjects)
+    merged = pd.concat([cached[keep], update], axis=0)
+    order = merged["participant_id"].map(
+        {pid: i for i, pid in enumerate(["group"] + subjects)}
+    )
+    merged = merged.assign(_order=order).sort_values(["CAP", "_order"], kind="stable")
+    return merged.drop(columns="_order").reset_index(drop=True)
+
+
+def cap_to_gradient(
+    data_path=None,
+    workers=1,
+    invalidate=False,
+    incremental=False,
+    cap_collection=None,
+):
+    """
+    Map all cap map to gradient space on real data.
+
+    When `data_path` is given, the result is cached there as a tsv file with a
+    `.json` sidecar holding the sha256 of the gradients, the group map and
+    each subject map. The cache is served only when all hashes match.
+
+    Parameters
+    ----------
+    data_path : str or Path, optional
+        Path to the cached gradient space tsv.
+
+    workers : int or None, optional
+        Number of processes reading the subject tsv files.
+
+    invalidate : bool, optional
+        Recompute and overwrite the cache regardless of its state.
+
+    incremental : bool, optional
+        When the gradients and group map are unchanged, only project subjects
+        that are new or whose map hash changed, and merge them into the cache.
+        Subjects no longer in `cap.json` are dropped.
+
+    cap_collection : str or Path, optional
+        Path to the dataset manifest. Default to `data/cap.json`.
+        The files are validated against it before they are loaded.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Gradient space in long format. `attrs["cache"]` records "hit",
+        "miss", "incremental" (with the projected subjects in
+        `attrs["updated"]`), or "unverified" when the inputs are not available
+        to check the cached file against.
+    """
+    manifest = Manifest.load(cap_collection)
+    path_cap = manifest.resolved()
+
+    if data_path is None:
+        gradient_space = _compute_gradient_space(manifest, workers)
+        gradient_space.attrs["cache"] = "miss"
+        return gradient_space
+
+    data_path = Path(data_path)
+    path_meta = data_path.with_suffix(".json")
+    try:
+        inputs = _cache_inputs(path_cap)
+    except FileNotFoundError as e:
+        if invalidate or not data_path.exists():
+            raise
+        warnings.warn(f"Serving {data_path} without validation: {e}")
+        gradient_space = read_tsv(data_path)
+        gradient_space.attrs["cache"] = "unverified"
+        return gradient_space
+
+    key = _cache_key(inputs)
+    cached = None
+    if not invalidate and data_path.exists() and path_meta.exists():
+        with open(path_meta) as json_file:
+            cached = json.load(json_file)
+        if cached["key"] == key:
+            gradient_space = read_tsv(data_path)
+            gradient_space.attrs.update(cache="hit", cache_key=key)
+            return gradient_space
+
+    shared = ("gradient", "group")
+    if incremental and cached and all(cached["inputs"][i] == inputs[i] for i in shared):
+        updated = [
+            sub
+            for sub, sha in inputs["subject"].items()
+            if cached["inputs"]["subject"].get(sub) != sha
+        ]
+        gradient_space = _merge_gradient_space(
+            read_tsv(data_path, dtype={"participant_id": str}),
+            _compute_gradient_space(manifest, workers, subjects=updated),
+            list(path_cap["subject"]),
+        )
+        status = {"cache": "incremental", "updated": updated}
+    else:
+        gradient_space = _compute_gradient_space(manifest, workers)
+        status = {"cache": "miss"}
+
+    gradient_space.to_csv(data_path, sep="\t", index=False)
+    with open(path_meta, "w") as fp:
+        json.dump({"key": key, "inputs": inputs}, fp, indent=2)
+    gradient_space.attrs.update(cache_key=key, **status)
     return gradient_space
+
+
+class GradientSpaceIndex:
+    """
+    Per CAP index of a gradient space, to select CAPs without scanning it.
+
+    The row positions of the group and subject points of each CAP are
+    computed once. Subject points are kept in a fixed random order, so
+    level of detail subsets are nested: a larger subset adds points to a
+    smaller one.
+
+    Parameters
+    ----------
+    gradient_space : pandas.DataFrame
+        Long format gradient space, see `cap_to_gradient`.
+
+    seed : int, optional
+        Seed of the order of the subject points.
+
+    Example
+    -------
+    >> index = GradientSpaceIndex(cap_to_gradient())
+    >> index.select([1, 2], max_points=200).shape
+    (402, 5)
+    """
+
+    def __init__(self, gradient_space, seed=0):
+        self.gradient_space = gradient_space.reset_index(drop=True)
+        self.columns = [f"Gradient {g + 1}" for g in range(N_GRADIENTS)]
+        self._coords = self.gradient_space[self.columns].values
+        is_group = (self.gradient_space["participant_id"] == "group").values
+        rng = np.random.default_rng(seed)
+        self.group = {}
+        self.subjects = {}
+        for cap, idx in self.gradient_space.groupby("CAP").indices.items():
+            self.group[cap] = idx[is_group[idx]]
+            self.subjects[cap] = rng.permutation(idx[~is_group[idx]])
+
+    @property
+    def caps(self):
+        return list(self.subjects)
+
+    def select(self, caps, max_points=None):
+        """
+        Rows of some CAPs: the group points and up to `max_points` subjects
+        per CAP, all subjects by default.
+        """
+        idx = [self.group[int(cap)] for cap in caps]
+        idx += [self.subjects[int(cap)][:max_points] for cap in caps]
+        idx = np.sort(np.concatenate(idx)) if idx else []
+        return self.gradient_space.iloc[idx]
+
+    def density(self, caps, bins=20, value_range=(-1, 1)):
+        """
+        Number of subject points of each CAP in a regular grid of the space.
+
+        Parameters
+        ----------
+        caps : list of int
+            CAPs to summarise.
+
+        bins : int, optional
+            Number of bins along each gradient.
+
+        value_range : tuple, optional
+            Range of the grid along each gradient.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The centre of the non-empty bins, with the "count" of points and
+            the "CAP".
+        """
+        edges = np.linspace(*value_range, bins + 1)
+        centres = (edges[:-1] + edges[1:]) / 2
+        collect = []
+        for cap in caps:
+            counts, _ = np.histogramdd(
+                self._coords[self.subjects[int(cap)]], bins=[edges] * N_GRADIENTS
+            )
+            nonzero = np.nonzero(counts)
+            df = pd.DataFrame(centres[np.array(nonzero)].T, columns=self.columns)
+            df["count"] = counts[nonzero].astype(int)
+            df["CAP"] = int(cap)
+            collect.append(df)
+        if not collect:
+            return pd.DataFrame(columns=self.columns + ["count", "CAP"])
+        return pd.concat(collect, ignore_index=True)
@@ -0,0 +1,219 @@
+import copy
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .utils import bounded_map, get_project_path, read_tsv
+
+MANIFEST_PATH = Path(get_project_path()) / "data/cap.json"
+
+
+def _hash_file(path):
+    """sha256 of a file, read in chunks."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _read_cap_map(path):
+    """Load one CAP map tsv as an array of shape (cap, roi)."""
+    return read_tsv(path, index_col=0).values.T
+
+
+def _file_shape(path):
+    """Shape of a CAP map, (ROI, CAP) as stored in the file."""
+    path = Path(path)
+    if path.suffix == ".npy":
+        return list(np.load(path, mmap_mode="r").shape)
+    return list(read_tsv(path, index_col=0).shape)
+
+
+class Manifest:
+    """
+    Description of the dataset, with records to validate the files against.
+
+    Holds the content of `cap.json`: the group map, the CAP map store,
+    the subject maps and the ROI labels. Paths are relative to the project
+    directory. `record` adds the size, sha256, shape and modification time
+    of each file; they are checked only when a file is validated or
+    loaded, and each file is checked once.
+
+    Parameters
+    ----------
+    dataset: dict
+        Content of `cap.json`, see `bin/make_dataset.py`.
+
+    root: str or Path, optional
+        Directory the paths are relative to. Default to the project path.
+
+    Example
+    -------
+    >> manifest = Manifest.load()
+    >> manifest.validate()
+    >> for subject, cap_map in manifest.iter_subjects():
+    ..     cap_map.shape
+    (8, 1054)
+    """
+
+    def __init__(self, dataset, root=None):
+        # a copy, recording the files leaves the caller's dataset unchanged
+        self.dataset = copy.deepcopy(dataset)
+        self.files = self.dataset.setdefault("files", {})
+        self.root = Path(root) if root is not None else Path(get_project_path())
+        self._checked = set()
+
+    @classmethod
+    def load(cls, path=None, root=None):
+        """Read a manifest, default to `data/cap.json`."""
+        with open(MANIFEST_PATH if path is None else path) as json_file:
+            return cls(json.load(json_file), root)
+
+    def save(self, path=None):
+        with open(MANIFEST_PATH if path is None else path, "w") as fp:
+            json.dump(self.dataset, fp, indent=2)
+
+    @property
+    def subjects(self):
+        return list(self.dataset["subject"])
+
+    def resolve(self, path):
+        """Absolute path of a file of the dataset."""
+        return self.root / path
+
+    def resolved(self):
+        """Content of the manifest with absolute paths."""
+        dataset = {
+            "group": str(self.resolve(self.dataset["group"])),
+            "subject": {
+                sub: str(self.resolve(path))
+                for sub, path in self.dataset["subject"].items()
+            },
+            "roi": self.dataset.get("roi"),
+        }
+        if self.dataset.get("store"):
+            dataset["store"] = str(self.resolve(self.dataset["store"]))
+        return dataset
+
+    def _paths(self, subjects=None):
+        """Files of the dataset, limited to some subjects."""
+        subjects = self.subjects if subjects is None else subjects
+        paths = [self.dataset["group"]]
+        if self.dataset.get("store"):
+            store = Path(self.dataset["store"])
+            paths += [str(store), str(store.with_suffix(".json"))]
+        return paths + [self.dataset["subject"][sub] for sub in subjects]
+
+    def record(self, subjects=None):
+        """Record the size, sha256, shape and modification time of the files."""
+        for path in self._paths(subjects):
+            full = self.resolve(path)
+            stat = os.stat(full)
+            self.files[path] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sha256": _hash_file(full),
+            }
+            if full.suffix != ".json":
+                self.files[path]["shape"] = _file_shape(full)
+        self._checked.clear()
+        return self
+
+    def check(self, path, checksum=False):
+        """
+        Check one file against its record.
+
+        The shape and sha256 are compared when the size or modification
+        time changed, or always with `checksum`. Files without a record are
+        only checked for existence.
+
+        Returns
+        -------
+        str or None
+            The problem found, None when the file is valid.
+        """
+        full = self.resolve(path)
+        if not full.exists():
+            return f"{path}: missing"
+        record = self.files.get(path)
+        if record is None:
+            return None
+        stat = os.stat(full)
+        changed = stat.st_size != record["size"] or stat.st_mtime != record["mtime"]
+        if not (changed or checksum):
+            return None
+        if "shape" in record:
+            try:
+                shape = _file_shape(full)
+            except (OSError, ValueError) as err:
+                return f"{path}: can not read the shape, {err}"
+            if shape != record["shape"]:
+                return f"{path}: shape {tuple(shape)} != {tuple(record['shape'])}"
+        if stat.st_size != record["size"]:
+            return f"{path}: size {stat.st_size} != {record['size']}"
+        if _hash_file(full) != record["sha256"]:
+            return f"{path}: sha256 does not match"
+        return None
+
+    def validate(self, subjects=None, checksum=False):
+        """
+        Check the files, all of them or those of some subjects.
+
+        Raises
+        ------
+        ValueError
+            Listing every missing or changed file.
+        """
+        paths = [p for p in self._paths(subjects) if checksum or p not in self._checked]
+        problems = [msg for msg in (self.check(p, checksum) for p in paths) if msg]
+        if problems:
+            raise ValueError(
+                f"{len(problems)} invalid file(s) in the dataset:\n"
+                + "\n".join(problems)
+            )
+        self._checked.update(paths)
+
+    def _load_subject(self, subject):
+        path = self.dataset["subject"][subject]
+        cap_map = _read_cap_map(self.resolve(path))
+        roi = self.dataset.get("roi")
+        if roi is not None and cap_map.shape[1] != len(roi):
+            raise ValueError(f"{path}: {cap_map.shape[1]} ROI, expected {len(roi)}")
+        return subject, cap_map
+
+    def iter_subjects(self, subjects=None, prefetch=4):
+        """
+        Load the subject maps one at a time.
+
+        All the files are validated before the first map is loaded, and
+        the number of ROI of each map is checked against the ROI labels.
+
+        Parameters
+        ----------
+        subjects: list of str, optional
+            Subjects to load, default to all.
+
+        prefetch: int, optional
+            Number of maps read ahead in background threads. 0 reads each
+            map when it is requested.
+
+        Yields
+        ------
+        subject: str
+
+        cap_map: numpy.ndarray, shape (cap, roi)
+        """
+        subjects = self.subjects if subjects is None else subjects
+        self.validate(subjects)
+        if not prefetch:
+            for sub in subjects:
+                yield self._load_subject(sub)
+            return
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            tasks = ((sub,) for sub in subjects)
+            yield from bounded_map(executor, self._load_subject, tasks, prefetch)
@@ -0,0 +1,410 @@
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import nibabel as nb
+import numpy as np
+import pandas as pd
+
+from .manifest import Manifest
+from .utils import CAPStore, bounded_map, get_project_path, read_tsv
+
+ATLAS_PATH = (
+    Path(get_project_path())
+    / "data/parcellations/SchaeferTian_combined_MNI152_2mm.nii.gz"
+)
+
+# atlas and map store loaded once per exporting process
+_EXPORTER = {}
+
+
+def _load_labels(atlas):
+    """Integer label volume of an atlas image."""
+    return np.asanyarray(atlas.dataobj).astype(np.int32)
+
+
+def parcel_lut(cap_values, n_labels=None):
+    """
+    Build a value table indexed by parcel label.
+
+    Parameters
+    ----------
+    cap_values : pandas.DataFrame
+        One row per parcel, indexed by the integer label in the atlas,
+        one column per CAP.
+
+    n_labels : int, optional
+        Size of the table. Default to the largest parcel label + 1.
+        Labels without a value, including the background 0, map to 0.
+
+    Returns
+    -------
+    numpy.ndarray, shape (n_labels, n_caps)
+    """
+    labels = cap_values.index.to_numpy(dtype=int)
+    if n_labels is None:
+        n_labels = labels.max() + 1
+    lut = np.zeros((n_labels, cap_values.shape[1]), dtype=np.float32)
+    lut[labels] = cap_values.values
+    return lut
+
+
+def paint_parcels(labels, cap_values):
+    """
+    Paint parcel values onto a label volume in a single pass.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray of int
+        Label volume, 0 is background.
+
+    cap_values : pandas.DataFrame or numpy.ndarray
+        Parcel values indexed by label, see `parcel_lut`. An array is taken
+        as the value table itself, shape (n_labels, n_caps).
+
+    Returns
+    -------
+    numpy.ndarray, shape labels.shape + (n_caps,)
+    """
+    if isinstance(cap_values, pd.DataFrame):
+        cap_values = parcel_lut(
+            cap_values, max(labels.max(), cap_values.index.max()) + 1
+        )
+    return np.take(cap_values, labels, axis=0)
+
+
+def _map_header(atlas):
+    """Header of the atlas for float maps, not the integer type of its labels."""
+    header = atlas.header.copy()
+    header.set_data_dtype(np.float32)
+    return header
+
+
+def cap_to_nifti(atlas, cap_values, split=False):
+    """
+    Map CAP values into nifti space with an atlas.
+
+    Parameters
+    ----------
+    atlas : nibabel.Nifti1Image
+        Atlas with integer labels matching the index of `cap_values`.
+
+    cap_values : pandas.DataFrame
+        One row per parcel, indexed by label, one column per CAP.
+
+    split : bool, optional
+        Return one 3D image per CAP instead of a single 4D image.
+
+    Returns
+    -------
+    nibabel.Nifti1Image or list of nibabel.Nifti1Image
+    """
+    data = paint_parcels(_load_labels(atlas), cap_values)
+    header = _map_header(atlas)
+    if not split:
+        return nb.Nifti1Image(data, affine=atlas.affine, header=header)
+    return [
+        nb.Nifti1Image(data[..., i], affine=atlas.affine, header=header)
+        for i in range(data.shape[-1])
+    ]
+
+
+class ParcelIndex:
+    """
+    Flat voxel offsets of every parcel in an atlas, stored as CSR arrays.
+
+    The voxels of `parcels[i]` are `offsets[indptr[i]:indptr[i + 1]]`, in C
+    order of the label volume. Parcel-wise operations then only touch the
+    voxels inside parcels instead of comparing the full volume per parcel.
+
+    Parameters
+    ----------
+    parcels : numpy.ndarray
+        Sorted parcel labels, background excluded.
+
+    indptr : numpy.ndarray
+        Start of each parcel in `offsets`, length n_parcels + 1.
+
+    offsets : numpy.ndarray
+        Flat voxel offsets grouped by parcel.
+
+    shape : tuple
+        Shape of the label volume.
+
+    Example
+    -------
+    >> index = load_parcel_index(ATLAS_PATH)
+    >> index.summarize(img.get_fdata())  # parcel means, shape (1054,)
+    """
+
+    def __init__(self, parcels, indptr, offsets, shape):
+        self.parcels = parcels
+        self.indptr = indptr
+        self.offsets = offsets
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_labels(cls, labels):
+        """Build the index from an integer label volume."""
+        flat = labels.ravel()
+        offsets = np.flatnonzero(flat)
+        order = np.argsort(flat[offsets], kind="stable")
+        offsets = offsets[order].astype(np.min_scalar_type(flat.size))
+        parcels, counts = np.unique(flat[offsets], return_counts=True)
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        return cls(parcels, indptr, offsets, labels.shape)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with `save`."""
+        with np.load(path) as index:
+            return cls(
+                index["parcels"], index["indptr"], index["offsets"], index["shape"]
+            )
+
+    def save(self, path):
+        """Save the index as a `.npz` file."""
+        np.savez(
+            path,
+            parcels=self.parcels,
+            indptr=self.indptr,
+            offsets=self.offsets,
+            shape=self.shape,
+        )
+
+    @property
+    def counts(self):
+        """Number of voxels per parcel."""
+        return np.diff(self.indptr)
+
+    def voxels(self, parcel):
+        """Flat voxel offsets of one parcel."""
+        i = np.searchsorted(self.parcels, parcel)
+        if i == len(self.parcels) or self.parcels[i] != parcel:
+            raise KeyError(f"Parcel {parcel} is not in the atlas.")
+        return self.offsets[self.indptr[i] : self.indptr[i + 1]]
+
+    def mask(self, parcels):
+        """Boolean volume of the voxels in one or several parcels."""
+        mask = np.zeros(np.prod(self.shape), dtype=bool)
+        for parcel in np.atleast_1d(parcels):
+            mask[self.voxels(parcel)] = True
+        return mask.reshape(self.shape)
+
+    def summarize(self, volume):
+        """
+        Mean of a 3D or 4D volume within each parcel.
+
+        Returns
+        -------
+        numpy.ndarray, shape (n_parcels,) or (n_parcels, n_volumes)
+        """
+        volume = np.asarray(volume)
+        flat = volume.reshape(np.prod(self.shape), -1)
+        sums = np.add.reduceat(flat[self.offsets], self.indptr[:-1], axis=0)
+        means = sums / self.counts[:, np.newaxis]
+        return means.squeeze(axis=1) if volume.ndim == len(self.shape) else means
+
+    def paint(self, values):
+        """
+        Paint parcel values onto the volume.
+
+        Parameters
+        ----------
+        values : array-like, shape (n_parcels,) or (n_parcels, n_caps)
+            Values in the order of `parcels`.
+        """
+        values = np.asarray(values)
+        out = np.zeros((np.prod(self.shape),) + values.shape[1:], dtype=values.dtype)
+        out[self.offsets] = np.repeat(values, self.counts, axis=0)
+        return out.reshape(self.shape + values.shape[1:])
+
+
+def parcel_index_path(atlas_path):
+    """Path of the parcel index saved next to an atlas."""
+    atlas_path = Path(atlas_path)
+    stem = atlas_path.name.split(".nii")[0]
+    return atlas_path.with_name(f"{stem}_index.npz")
+
+
+def load_parcel_index(atlas_path):
+    """
+    Load the parcel index of an atlas, building and saving it when missing
+    or older than the atlas.
+    """
+    index_path = parcel_index_path(atlas_path)
+    if (
+        index_path.exists()
+        and index_path.stat().st_mtime >= Path(atlas_path).stat().st_mtime
+    ):
+        return ParcelIndex.load(index_path)
+    index = ParcelIndex.from_labels(_load_labels(nb.load(atlas_path)))
+    index.save(index_path)
+    return index
+
+
+def _read_labels(img, slab_size):
+    """
+    Read an atlas once, slab by slab along the last axis, into the smallest
+    unsigned integer dtype that holds its labels.
+    """
+    labels = np.zeros(img.shape, dtype=np.uint8)
+    for start in range(0, img.shape[-1], slab_size):
+        slab = np.asarray(img.dataobj[..., start : start + slab_size])
+        slab_max = slab.max()
+        if slab_max > np.iinfo(labels.dtype).max:
+            labels = labels.astype(np.min_scalar_type(int(slab_max)))
+        labels[..., start : start + slab_size] = slab
+    return labels
+
+
+def combine_atlases(*imgs, slab_size=16):
+    """
+    Combine atlases in the same space into one.
+
+    Labels of each atlas are shifted by the largest label of the atlases
+    before it. Voxels labelled in more than one atlas are set to 0 and
+    reported in the overlap image. Each atlas is read once as the smallest
+    integer dtype that fits, and the relabelling is done slab by slab along
+    the last axis to keep the peak memory low.
+
+    Parameters
+    ----------
+    *imgs : nibabel.Nifti1Image
+        Atlases with integer labels, 0 as background, same shape and affine.
+
+    slab_size : int, optional
+        Number of slices processed at once.
+
+    Returns
+    -------
+    combined : nibabel.Nifti1Image
+        Combined atlas.
+
+    overlap : nibabel.Nifti1Image or None
+        Voxels labelled in more than one atlas, None if there is none.
+    """
+    ref = imgs[0]
+    labels = [_read_labels(img, slab_size) for img in imgs]
+    label_max = [int(i.max()) for i in labels]
+    offsets = np.cumsum([0] + label_max[:-1])
+    dtype = np.min_scalar_type(sum(label_max))
+
+    combined = np.zeros(ref.shape, dtype=dtype)
+    overlap = np.zeros(ref.shape, dtype=np.uint8)
+    for start in range(0, ref.shape[-1], slab_size):
+        slab = np.s_[..., start : start + slab_size]
+        combined_slab = combined[slab]
+        n_labelled = np.zeros(combined_slab.shape, dtype=np.uint8)
+        for atlas, offset in zip(labels, offsets):
+            atlas_slab = atlas[slab]
+            labelled = atlas_slab > 0
+            combined_slab[labelled] = atlas_slab[labelled] + offset
+            n_labelled += labelled
+        overlap[slab] = n_labelled > 1
+        combined_slab[overlap[slab] > 0] = 0
+
+    header = ref.header.copy()
+    header.set_data_dtype(dtype)
+    combined = nb.Nifti1Image(combined, affine=ref.affine, header=header)
+    n_overlap = int(overlap.sum())
+    if n_overlap == 0:
+        return combined, None
+
+    warnings.warn(f"Input images contain {n_overlap} overlapping voxels.")
+    header = ref.header.copy()
+    header.set_data_dtype(np.uint8)
+    return combined, nb.Nifti1Image(overlap, affine=ref.affine, header=header)
+
+
+def _init_exporter(atlas_path, store_path):
+    """Load the atlas, and the map store if any, once per process."""
+    atlas = nb.load(atlas_path)
+    _EXPORTER["atlas"] = atlas
+    _EXPORTER["labels"] = _load_labels(atlas)
+    _EXPORTER["store"] = CAPStore(store_path) if store_path else None
+
+
+def _export_subject(sub, path, out_dir, split):
+    """Paint and save the CAP maps of one subject."""
+    atlas, labels, store = (_EXPORTER[k] for k in ("atlas", "labels", "store"))
+    if store is not None:
+        cap_values = store.to_frame(sub)
+    else:
+        cap_values = read_tsv(path, index_col=0)
+    lut = parcel_lut(cap_values, max(labels.max(), cap_values.index.max()) + 1)
+    data = paint_parcels(labels, lut)
+
+    sub_dir = Path(out_dir) / f"sub-{sub}"
+    sub_dir.mkdir(parents=True, exist_ok=True)
+    header = _map_header(atlas)
+    if not split:
+        out_file = sub_dir / f"sub-{sub}_desc-capmap_bold.nii.gz"
+        nb.Nifti1Image(data, affine=atlas.affine, header=header).to_filename(out_file)
+        return [str(out_file)]
+
+    out_files = []
+    for i, cap in enumerate(cap_values.columns):
+        out_file = sub_dir / f"sub-{sub}_desc-{cap.replace('_', '')}_bold.nii.gz"
+        nb.Nifti1Image(data[..., i], affine=atlas.affine, header=header).to_filename(
+            out_file
+        )
+        out_files.append(str(out_file))
+    return out_files
+
+
+def export_subject_niftis(
+    out_dir, cap_collection=None, atlas_path=ATLAS_PATH, split=False, workers=1
+):
+    """
+    Export the CAP maps of every subject to nifti, without plotting.
+
+    The atlas is loaded once per process and subjects are painted one at a
+    time with a bounded number of tasks in flight, so memory use does not
+    grow with the cohort size.
+
+    Parameters
+    ----------
+    out_dir : str or Path
+        Output directory. Files are saved as
+        `sub-<label>/sub-<label>_desc-capmap_bold.nii.gz`.
+
+    cap_collection : str or Path, optional
+        Path to the dataset description, see `nkicap.Manifest`. Default to
+        `data/cap.json`. The files are validated before any is exported.
+        The map store is used when listed, otherwise the subject tsv files.
+
+    atlas_path : str or Path, optional
+        Atlas matching the ROI index of the CAP maps.
+
+    split : bool, optional
+        Save one 3D image per CAP (`desc-cap01`, ...) instead of one 4D image.
+
+    workers : int or None, optional
+        Number of processes writing the files. None uses all cores.
+
+    Returns
+    -------
+    dict(str -> list of str)
+        Output files of each subject, in the order of `cap.json`.
+    """
+    manifest = Manifest.load(cap_collection)
+    manifest.validate()
+    path_cap = manifest.resolved()
+
+    store_path = path_cap.get("store")
+    tasks = ((sub, path, out_dir, split) for sub, path in path_cap["subject"].items())
+    if workers == 1:
+        _init_exporter(atlas_path, store_path)
+        outputs = (_export_subject(*task) for task in tasks)
+        return dict(zip(path_cap["subject"], outputs))
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_exporter,
+        initargs=(atlas_path, store_path),
+    ) as executor:
+        max_pending = 2 * (workers or os.cpu_count())
+        outputs = bounded_map(executor, _export_subject, tasks, max_pending)
+        return dict(zip(path_cap["subject"], outputs))
@@ -1,11 +1,21 @@
+import sys
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
 import matplotlib.colors as mcolor
+import numpy as np
 from matplotlib import cm
+from PIL import ImageFont
 from wordcloud import WordCloud
 
-from .utils import get_project_path
+from .utils import get_project_path, parallel_map
 
 FONT_PATH = str(get_project_path() / "data/Arimo-VariableFont_wght.ttf")
 
+# word cloud reused by all panels rendered in a worker process
+_WORDCLOUD = None
+
 
 class CoefficientWordCloud(WordCloud):
     """Create word cloud for coefficient values.
@@ -79,18 +89,161 @@ class CoefficientColor:
     """
 
     def __init__(self, word_coeff, cmap="RdBu_r", default_color="grey"):
-        vmax = _find_absmax(word_coeff.values())
-        word_to_color = {}
-        for (word, val) in word_coeff.items():
-            v = _rescale(val, vmax)
-            word_to_color[word] = _get_color_hex(v, cmap)
-        self.word_to_color = word_to_color
+        colors = coefficient_colors(list(word_coeff.values()), cmap)
+        self.word_to_color = dict(zip(word_coeff, colors))
         self.default_color = default_color
 
     def __call__(self, word, **kwargs):
         return self.word_to_color.get(word, self.default_color)
 
 
+@lru_cache(maxsize=None)
+def _truetype(font_path, size):
+    """Font of one size, loaded once per process."""
+    return ImageFont.truetype(font_path, size)
+
+
+class _CachedImageFont:
+    """`PIL.ImageFont` as seen by wordcloud, with memoised truetype fonts."""
+
+    def __getattr__(self, name):
+        return getattr(ImageFont, name)
+
+    @staticmethod
+    def truetype(font, size=10, *args, **kwargs):
+        if args or kwargs:
+            return ImageFont.truetype(font, size, *args, **kwargs)
+        return _truetype(font, size)
+
+
+@contextmanager
+def _cached_fonts():
+    """
+    Reuse the fonts across words and panels.
+
+    wordcloud loads the font file again for every word it places or writes
+    to svg; the fonts are instead loaded once per size.
+    """
+    module = sys.modules[WordCloud.__module__]
+    image_font = module.ImageFont
+    module.ImageFont = _CachedImageFont()
+    try:
+        yield
+    finally:
+        module.ImageFont = image_font
+
+
+def _init_wordcloud(args):
+    global _WORDCLOUD
+    _WORDCLOUD = CoefficientWordCloud(**args)
+
+
+def _render_wordcloud(name, word_value, cmap, out_dir, formats):
+    """Lay out one panel with the worker's word cloud and save it."""
+    _WORDCLOUD.color_func = CoefficientColor(word_value, cmap=cmap)
+    paths = []
+    with _cached_fonts():
+        pic = _WORDCLOUD.heatmap_to_wordcloud(word_value)
+        for ext in formats:
+            path = Path(out_dir) / f"{name}.{ext}"
+            if ext == "svg":
+                path.write_text(pic.to_svg())
+            else:
+                pic.to_file(str(path))
+            paths.append(path)
+    return paths
+
+
+def render_wordclouds(
+    word_values, out_dir, cmap="RdBu_r", formats=("png", "svg"), workers=1, **args
+):
+    """Render many coefficient word clouds, optionally in parallel.
+
+    Each worker process builds one CoefficientWordCloud and reuses it for
+    all the panels it renders, with each font size loaded once.
+
+    Parameters
+    ----------
+    word_values: dict(str -> dict(str -> float))
+        Panel name to the word and value pairings of the panel, such as
+        the loadings of each canonical mode.
+    out_dir: str or Path
+        Output directory, panels are saved as `<name>.<format>`.
+    cmap: str
+        Name of the matplotlib color map of choice, see CoefficientColor
+    formats: tuple of str
+        File formats to save, "svg" or any format supported by pillow.
+    workers: int or None
+        Number of processes. 1 renders serially; None uses all cores.
+    **args: key, value pairings
+        Passed to CoefficientWordCloud.
+
+    Returns
+    -------
+    dict(str -> list of Path)
+        Saved files of each panel.
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    names = list(word_values)
+    tasks = (
+        names,
+        [word_values[name] for name in names],
+        [cmap] * len(names),
+        [out_dir] * len(names),
+        [formats] * len(names),
+    )
+    saved = parallel_map(
+        _render_wordcloud,
+        *tasks,
+        workers=workers,
+        initializer=_init_wordcloud,
+        initargs=(args,),
+    )
+    return dict(zip(names, saved))
+
+
+def coefficient_colors(values, cmap="RdBu_r", vmax=None):
+    """Map coefficients to hex colors on a colormap centred around zero
+
+    All values are mapped at once through the lookup table of the colormap,
+    giving the same colors as calling the colormap on each value.
+
+    Parameters
+    ----------
+    values : array like
+        Numerical values
+    cmap : str
+        matplotlib color map name
+    vmax : float
+        Value mapped to the top of the color map, and -vmax to the bottom.
+        Default to the absolute maximum of the values.
+
+    Returns
+    -------
+    numpy.ndarray of str
+        Hex code color of each value
+    """
+    values = np.asarray(values, dtype=float)
+    if vmax is None:
+        vmax = _find_absmax(values)
+    lut = _colormap_lut(cmap)
+    n = len(lut) - 1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scaled = _rescale(values, vmax) * n
+    # index as matplotlib does, the last entry holds the color of NaN
+    idx = np.clip(np.nan_to_num(scaled, nan=n), 0, n - 1).astype(int)
+    idx[np.isnan(scaled)] = n
+    return lut[idx]
+
+
+@lru_cache(maxsize=None)
+def _colormap_lut(cmap):
+    """Hex codes of every entry of a color map, then of its NaN color"""
+    cm_obj = cm.get_cmap(cmap)
+    rgba = list(cm_obj(np.arange(cm_obj.N))) + [cm_obj(np.nan)]
+    return np.array([mcolor.to_hex(c) for c in rgba])
+
+
 def val_to_freq(word_value, scalar):
     """turn value to integer"""
     return {k: abs(int(word_value[k] * scalar)) for k in word_value}
@@ -104,11 +257,7 @@ def _find_absmax(values):
     values : List
         A list of numerical values
     """
-    vmax = 0
-    for i in values:
-        if abs(i) > vmax:
-            vmax = abs(i)
-    return vmax
+    return np.abs(np.fromiter(values, dtype=float)).max(initial=0)
 
 
 def _rescale(value, vmax):
@@ -0,0 +1,358 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.stats import rankdata
+
+
+def _zscore(x):
+    """Column-wise z-score with population standard deviation."""
+    x = np.asarray(x, dtype=float)
+    return (x - x.mean(axis=0)) / x.std(axis=0)
+
+
+def _run_chunks(func, args, n, chunk_size, seed, workers):
+    """
+    Run `func(*args, seed, n_chunk)` over chunks of `n` resamples.
+
+    Each chunk gets its own child of `SeedSequence(seed)`, so the results
+    are the same for any number of workers.
+    """
+    sizes = [min(chunk_size, n - i) for i in range(0, n, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    chunks = [tuple(args) + (s, n_chunk) for s, n_chunk in zip(seeds, sizes)]
+    if workers == 1:
+        return [func(*chunk) for chunk in chunks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, *zip(*chunks)))
+
+
+def _permutation_chunk(zx, zy, r_abs, seed, n_perm):
+    """Null distribution of one chunk of row permutations of `zy`."""
+    rng = np.random.default_rng(seed)
+    perm = rng.permuted(np.tile(np.arange(zy.shape[0]), (n_perm, 1)), axis=1)
+    # (n_perm, p, q), one GEMM per permutation
+    null = np.abs(np.matmul(zx.T, zy[perm]))
+    return null.max(axis=(1, 2)), (null >= r_abs).sum(axis=0)
+
+
+def permutation_corr(
+    x, y, n_perm=10000, method="pearson", seed=None, chunk_size=100, workers=1
+):
+    """
+    Correlation between two sets of variables with permutation inference.
+
+    Rows of `y` are permuted. Both sets are z-scored (and ranked, for
+    Spearman's correlation) once, so each permutation is a single matrix
+    product. Family-wise error is controlled with the maximum statistic
+    across all pairs of variables.
+
+    Parameters
+    ----------
+    x : pandas.DataFrame or numpy.ndarray, shape (n_subjects, p)
+        First set of variables, such as CAP features.
+
+    y : pandas.DataFrame or numpy.ndarray, shape (n_subjects, q)
+        Second set of variables, such as MRIQ items.
+
+    n_perm : int, optional
+        Number of permutations.
+
+    method : str, optional
+        "pearson" or "spearman".
+
+    seed : int, optional
+        Seed of the permutations. For a given seed and `chunk_size`, results
+        do not depend on `workers`.
+
+    chunk_size : int, optional
+        Number of permutations evaluated in one batch.
+
+    workers : int or None, optional
+        Number of processes. None uses all cores.
+
+    Returns
+    -------
+    r : pandas.DataFrame, shape (p, q)
+        Correlation coefficients.
+
+    p_uncorrected : pandas.DataFrame, shape (p, q)
+        Two-sided permutation p-values of each pair.
+
+    p_fwer : pandas.DataFrame, shape (p, q)
+        Two-sided p-values corrected with the maximum statistic.
+    """
+    index = x.columns if isinstance(x, pd.DataFrame) else None
+    columns = y.columns if isinstance(y, pd.DataFrame) else None
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if method == "spearman":
+        x, y = rankdata(x, axis=0), rankdata(y, axis=0)
+    elif method != "pearson":
+        raise ValueError(f"Unknown method {method}, use 'pearson' or 'spearman'.")
+
+    zx = _zscore(x) / x.shape[0]
+    zy = _zscore(y)
+    r = zx.T @ zy
+    r_abs = np.abs(r)
+
+    results = _run_chunks(
+        _permutation_chunk, (zx, zy, r_abs), n_perm, chunk_size, seed, workers
+    )
+
+    null_max = np.concatenate([res[0] for res in results])
+    count = np.sum([res[1] for res in results], axis=0)
+    p_uncorrected = (count + 1) / (n_perm + 1)
+    n_exceed = n_perm - np.searchsorted(np.sort(null_max), r_abs, side="left")
+    p_fwer = (n_exceed + 1) / (n_perm + 1)
+    return tuple(
+        pd.DataFrame(val, index=index, columns=columns)
+        for val in (r, p_uncorrected, p_fwer)
+    )
+
+
+def adjust_pvalues(pvalues, method="bonferroni"):
+    """
+    Correct p-values for multiple comparisons along the last axis.
+
+    Parameters
+    ----------
+    pvalues : numpy.ndarray
+        Uncorrected p-values. Each row along the last axis is one family.
+
+    method : str, optional
+        "bonferroni" or "fdr_bh" (Benjamini-Hochberg), as in
+        statsmodels.stats.multitest.multipletests.
+
+    Returns
+    -------
+    numpy.ndarray
+        Corrected p-values.
+    """
+    pvalues = np.asarray(pvalues, dtype=float)
+    m = pvalues.shape[-1]
+    if method == "bonferroni":
+        return np.minimum(pvalues * m, 1)
+    if method != "fdr_bh":
+        raise ValueError(f"Unknown method {method}, use 'bonferroni' or 'fdr_bh'.")
+    order = np.argsort(pvalues, axis=-1)
+    ranked = np.take_along_axis(pvalues, order, axis=-1) * m / np.arange(1, m + 1)
+    # enforce monotonicity from the largest p-value down
+    ranked = np.minimum.accumulate(ranked[..., ::-1], axis=-1)[..., ::-1]
+    adjusted = np.empty_like(ranked)
+    np.put_along_axis(adjusted, order, np.minimum(ranked, 1), axis=-1)
+    return adjusted
+
+
+def mass_univariate_ols(endog, exog, method="bonferroni"):
+    """
+    Fit one OLS model per dependent variable against a shared design.
+
+    All dependent variables are solved together with a single
+    pseudo-inverse of the design matrix, with an intercept added, so
+    rank deficient designs are fitted as by statsmodels.
+
+    Parameters
+    ----------
+    endog : pandas.DataFrame, shape (n_subjects, n_dv)
+        Dependent variables, one model per column.
+
+    exog : pandas.DataFrame, shape (n_subjects, n_iv)
+        Independent variables shared by all models.
+
+    method : str, optional
+        Multiple comparison correction across the coefficients of each
+        model, see `adjust_pvalues`.
+
+    Returns
+    -------
+    dict(str -> pandas.DataFrame)
+        "params", "bse", "tvalues", "pvalues" and "pvalues_adjusted",
+        each of shape (n_dv, n_iv + 1) with "Intercept" as first column.
+        Values are the same as statsmodels OLS fitted per column.
+    """
+    names = ["Intercept"] + exog.columns.tolist()
+    X = np.column_stack([np.ones(exog.shape[0]), np.asarray(exog, dtype=float)])
+    Y = np.asarray(endog, dtype=float)
+
+    # same cutoff as statsmodels, rank deficient designs get the minimum
+    # norm solution
+    pinv_x = np.linalg.pinv(X, rcond=1e-15)
+    params = pinv_x @ Y
+    resid = Y - X @ params
+    df_resid = X.shape[0] - np.linalg.matrix_rank(X)
+    scale = (resid**2).sum(axis=0) / df_resid
+    cov_diag = (pinv_x**2).sum(axis=1)  # diagonal of (X'X)^+
+    bse = np.sqrt(np.outer(cov_diag, scale))
+    tvalues = params / bse
+    pvalues = 2 * stats.t.sf(np.abs(tvalues), df_resid)
+
+    results = {
+        "params": params.T,
+        "bse": bse.T,
+        "tvalues": tvalues.T,
+        "pvalues": pvalues.T,
+        "pvalues_adjusted": adjust_pvalues(pvalues.T, method),
+    }
+    return {
+        key: pd.DataFrame(val, index=endog.columns, columns=names)
+        for key, val in results.items()
+    }
+
+
+MV_STATS = [
+    "Wilks' lambda",
+    "Pillai's trace",
+    "Hotelling-Lawley trace",
+    "Roy's greatest root",
+]
+
+
+def _mv_test_frame(tau, p, q, df_resid, effects):
+    """
+    Multivariate test statistics of single degree of freedom terms.
+
+    `tau` is the only non-zero eigenvalue of inv(E)H of each term. Degrees
+    of freedom and F approximations follow statsmodels' multivariate_stats.
+    """
+    v = df_resid
+    s = min(p, q)
+    m = (abs(p - q) - 1) / 2
+    n = (v - p - 1) / 2
+    theta = tau / (1 + tau)  # eigenvalue of inv(E + H)H
+    rows = {}
+
+    # Wilks' lambda
+    wilks = 1 - theta
+    t = np.sqrt((p * p * q * q - 4) / (p * p + q * q - 5)) if p * p + q * q > 5 else 1
+    df1 = p * q
+    df2 = (v - (p - q + 1) / 2) * t - 2 * (p * q - 2) / 4
+    lmd = wilks ** (1 / t)
+    rows[MV_STATS[0]] = (wilks, df1, df2, (1 - lmd) / lmd * df2 / df1)
+
+    # Pillai's trace
+    df1 = s * (2 * m + s + 1)
+    df2 = s * (2 * n + s + 1)
+    rows[MV_STATS[1]] = (theta, df1, df2, df2 / df1 * theta / (s - theta))
+
+    # Hotelling-Lawley trace
+    if n > 0:
+        b = (p + 2 * n) * (q + 2 * n) / 2 / (2 * n + 1) / (n - 1)
+        df1 = p * q
+        df2 = 4 + (p * q + 2) / (b - 1)
+        f_value = df2 / df1 * tau / ((df2 - 2) / 2 / n)
+    else:
+        df1 = s * (2 * m + s + 1)
+        df2 = s * (s * n + 1)
+        f_value = df2 / df1 / s * tau
+    rows[MV_STATS[2]] = (tau, df1, df2, f_value)
+
+    # Roy's greatest root
+    df1 = max(p, q)
+    df2 = v - df1 + q
+    rows[MV_STATS[3]] = (tau, df1, df2, df2 / df1 * tau)
+
+    collect = []
+    for stat, (value, df1, df2, f_value) in rows.items():
+        df = pd.DataFrame(
+            {
+                "Effect": effects,
+                "Statistic": stat,
+                "Value": value,
+                "Num DF": float(df1),
+                "Den DF": float(df2),
+                "F Value": f_value,
+                "Pr > F": stats.f.sf(f_value, df1, df2),
+                "Partial eta sq.": df1 * f_value / (df1 * f_value + df2),
+            }
+        )
+        collect.append(df)
+    frame = pd.concat(collect).set_index(["Effect", "Statistic"])
+    return frame.loc[effects]
+
+
+def _manova_tau(coef, sscp_y, gram, inv_cov_diag):
+    """
+    Non-zero eigenvalue of inv(E)H for each exog term, for a stack of fits.
+
+    The error SSCP is E = Y'Y - B'X'XB and the hypothesis SSCP of term i is
+    H_i = b_i b_i' / inv(X'X)_ii, so inv(E)H_i has a single non-zero
+    eigenvalue b_i' inv(E) b_i / inv(X'X)_ii.
+    """
+    error = sscp_y - np.swapaxes(coef, -1, -2) @ gram @ coef
+    solved = np.linalg.solve(error, np.swapaxes(coef, -1, -2))
+    return np.einsum("...ij,...ji->...i", coef, solved) / inv_cov_diag
+
+
+def _manova_permutation_chunk(pinv_x, y, sscp_y, gram, inv_cov_diag, seed, n_perm):
+    """Wilks' lambda of each term for one chunk of row permutations of y."""
+    rng = np.random.default_rng(seed)
+    perm = rng.permuted(np.tile(np.arange(y.shape[0]), (n_perm, 1)), axis=1)
+    # permuting the rows of y permutes the columns of the projection;
+    # Y'Y is the same for all permutations
+    coef = pinv_x[:, perm].transpose(1, 0, 2) @ y
+    return 1 / (1 + _manova_tau(coef, sscp_y, gram, inv_cov_diag))
+
+
+def manova(endog, exog, n_perm=0, seed=None, chunk_size=100, workers=1):
+    """
+    Multivariate tests of each independent variable, in one pass.
+
+    Equivalent to `statsmodels.multivariate.manova.MANOVA(endog, exog)
+    .mv_test().summary_frame`: each column of `exog` is tested on its own
+    and no intercept is added. The error SSCP matrix is computed once and
+    the four statistics of all terms are derived from it together.
+
+    Parameters
+    ----------
+    endog : pandas.DataFrame, shape (n_subjects, n_dv)
+        Dependent variables.
+
+    exog : pandas.DataFrame, shape (n_subjects, n_iv)
+        Independent variables, one test per column.
+
+    n_perm : int, optional
+        Number of row permutations of `endog` for permutation p-values.
+        0 skips the permutation test.
+
+    seed, chunk_size, workers : optional
+        See `permutation_corr`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by (Effect, Statistic), with the columns "Value", "Num DF",
+        "Den DF", "F Value", "Pr > F" and "Partial eta sq.". With `n_perm`,
+        "Perm. Pr" holds the permutation p-value, the same for all four
+        statistics as they are monotonic in each other for a single
+        degree of freedom term.
+    """
+    effects = exog.columns.tolist()
+    X = np.asarray(exog, dtype=float)
+    Y = np.asarray(endog, dtype=float)
+
+    pinv_x = np.linalg.pinv(X)
+    gram = X.T @ X
+    inv_cov_diag = np.diag(pinv_x @ pinv_x.T)
+    sscp_y = Y.T @ Y
+    tau = _manova_tau(pinv_x @ Y, sscp_y, gram, inv_cov_diag)
+
+    df_resid = X.shape[0] - X.shape[1]
+    p = np.linalg.matrix_rank(sscp_y - (pinv_x @ Y).T @ gram @ (pinv_x @ Y))
+    frame = _mv_test_frame(tau, p, 1, df_resid, effects)
+    if not n_perm:
+        return frame
+
+    results = _run_chunks(
+        _manova_permutation_chunk,
+        (pinv_x, Y, sscp_y, gram, inv_cov_diag),
+        n_perm,
+        chunk_size,
+        seed,
+        workers,
+    )
+    null = np.concatenate(results)
+    wilks = 1 / (1 + tau)
+    p_perm = ((null <= wilks).sum(axis=0) + 1) / (n_perm + 1)
+    frame["Perm. Pr"] = np.repeat(p_perm, len(MV_STATS))
+    return frame
@@ -0,0 +1,204 @@
+"""Run grids of multivariate multiple regressions concurrently."""
+import hashlib
+import itertools
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from .stats import manova, mass_univariate_ols
+from .utils import TRANSFORMS
+
+# Data instance shared by the jobs of a worker process
+_DATA = None
+
+
+def make_grid(endog, exog, covariates=(None,), mriq_drop=(None,)):
+    """
+    Build the jobs of a sweep from every combination of the settings.
+
+    Parameters
+    ----------
+    endog, exog : list of str
+        Names of the variable sets, a keyword of `Data.load` or a key of
+        `sets` in `run_sweep`.
+
+    covariates : list of None or list of str, optional
+        Columns of the dataset added to the independent variables.
+
+    mriq_drop : list of None or list of str, optional
+        MRIQ items to drop, see `Data`.
+
+    Returns
+    -------
+    list of dict
+        One job per combination.
+    """
+    return [
+        {
+            "endog": e,
+            "exog": x,
+            "covariates": list(c) if c else [],
+            "mriq_drop": list(d) if d else None,
+        }
+        for e, x, c, d in itertools.product(endog, exog, covariates, mriq_drop)
+    ]
+
+
+def job_name(job):
+    """File name of a job, stable across runs."""
+    key = hashlib.sha1(json.dumps(job, sort_keys=True).encode()).hexdigest()
+    return "-".join([job["endog"].strip("_"), job["exog"].strip("_"), key[:8]])
+
+
+def _load_set(data, name, sets, mriq_drop):
+    """Variable set by name, from `sets` or `Data.load`."""
+    if sets and name in sets:
+        return sets[name](data)
+    return data.load(name, mriq_drop=mriq_drop)
+
+
+def _init_worker(data):
+    global _DATA
+    _DATA = data
+
+
+def fit_job(data, job, sets=None):
+    """
+    Fit the MANOVA and mass univariate OLS of one job.
+
+    Returns
+    -------
+    dict
+        JSON serialisable results: the multivariate tests and the
+        univariate estimates, as pandas "split" dictionaries.
+    """
+    # an empty list keeps all MRIQ items, whatever the drop list of `data`
+    drop = job["mriq_drop"] or []
+    endog = _load_set(data, job["endog"], sets, drop)
+    exog = _load_set(data, job["exog"], sets, drop)
+    if job["covariates"]:
+        exog = pd.concat([exog, data._select(job["covariates"])], axis=1)
+    subjects = endog.dropna().index.intersection(exog.dropna().index)
+    zscore = TRANSFORMS["zscore"]
+    endog, exog = zscore(endog.loc[subjects]), zscore(exog.loc[subjects])
+
+    univariate = mass_univariate_ols(endog, exog, method="bonferroni")
+    return {
+        "n_subjects": len(subjects),
+        "multivariate": manova(endog, exog).reset_index().to_dict(orient="split"),
+        "univariate": {k: v.to_dict(orient="split") for k, v in univariate.items()},
+    }
+
+
+def _run_job(job, path, sets):
+    """Run a job in a worker and write its results, or the failure, to `path`."""
+    output = {"job": job}
+    try:
+        output.update(fit_job(_DATA, job, sets))
+        output["status"] = "done"
+    except Exception:
+        output["status"] = "failed"
+        output["error"] = traceback.format_exc()
+    # write then rename, an interrupted job leaves no partial result
+    tmp = Path(f"{path}.tmp")
+    tmp.write_text(json.dumps(output, indent=2))
+    os.replace(tmp, path)
+    return output["status"]
+
+
+def job_status(path):
+    """Status of a job output: "done", "failed" or "missing"."""
+    try:
+        return json.loads(Path(path).read_text())["status"]
+    except (OSError, ValueError, KeyError):
+        return "missing"
+
+
+def run_sweep(data, jobs, out_dir, sets=None, workers=1, resume=True):
+    """
+    Run the jobs of a sweep, each writing `<out_dir>/<job_name>.json`.
+
+    Parameters
+    ----------
+    data : nkicap.Data
+        Loaded once and shared by all jobs of a worker process.
+
+    jobs : list of dict
+        Jobs from `make_grid`.
+
+    out_dir : str or Path
+        Output directory.
+
+    sets : dict, optional
+        Variable sets not available as `Data.load` keywords, name to a
+        picklable function taking the `Data` instance. The MRIQ drop list
+        of a job only applies to the keywords.
+
+    workers : int or None, optional
+        Number of worker processes, None for all cores. 1 runs serially.
+
+    resume : bool, optional
+        Skip the jobs already done, rerunning only failed or missing jobs.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Status and output path of each job, indexed by job name.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = {job_name(job): out_dir / f"{job_name(job)}.json" for job in jobs}
+    todo = [
+        (job, path)
+        for job, path in zip(jobs, paths.values())
+        if not (resume and job_status(path) == "done")
+    ]
+    if todo:
+        args = list(zip(*todo)) + [[sets] * len(todo)]
+        if workers == 1:
+            _init_worker(data)
+            list(map(_run_job, *args))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(data,)
+            ) as executor:
+                list(executor.map(_run_job, *args))
+    return pd.DataFrame(
+        {
+            "status": [job_status(path) for path in paths.values()],
+            "path": list(paths.values()),
+        },
+        index=pd.Index(paths.keys(), name="job"),
+    )
+
+
+def load_results(out_dir, key="multivariate"):
+    """
+    Collect one result table of all finished jobs of a sweep.
+
+    Parameters
+    ----------
+    key : str, optional
+        "multivariate" or one of the univariate estimates, such as
+        "params" or "pvalues_adjusted".
+
+    Returns
+    -------
+    pandas.DataFrame
+        The tables of all jobs, with the job name as the outer index.
+    """
+    tables = {}
+    for path in sorted(Path(out_dir).glob("*.json")):
+        output = json.loads(path.read_text())
+        if output.get("status") != "done":
+            continue
+        if key == "multivariate":
+            table = pd.DataFrame(**output[key]).set_index(["Effect", "Statistic"])
+        else:
+            table = pd.DataFrame(**output["univariate"][key])
+        tables[path.stem] = table
+    return pd.concat(tables, names=["job"])
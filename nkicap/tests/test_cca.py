@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from ..cca import _bootstrap_chunk, bootstrap_cca, cca, permutation_cca
+from .utils import make_correlated
+
+
+def _data(n=200):
+    X, Y = make_correlated(n, 4, 3)
+    return X - X.mean(axis=0), Y - Y.mean(axis=0)
+
+
+def _reference_cca(X, Y):
+    # the original implementation in bin/descriptive.py
+    ux, sx, vx = np.linalg.svd(X, 0)
+    uy, sy, vy = np.linalg.svd(Y, 0)
+    u, s, v = np.linalg.svd(ux.T.dot(uy), 0)
+    a = (vx.T).dot(u)
+    b = (vy.T).dot(v.T)
+    return a, b, s
+
+
+def test_cca():
+    X, Y = _data()
+    a, b, s = cca(X, Y)
+    for res, ref in zip((a, b, s), _reference_cca(X, Y)):
+        np.testing.assert_allclose(res, ref)
+    assert s[0] > 0.7
+    # stacked input
+    a, b, s = cca(np.stack([X, X[::-1]]), np.stack([Y, Y[::-1]]))
+    assert a.shape == (2, 4, 3)
+    np.testing.assert_allclose(s[0], s[1])
+
+
+def test_bootstrap_cca():
+    X, Y = _data()
+    a_ref, b_ref, s_ref = cca(X, Y)
+    a, b, s = bootstrap_cca(X, Y, n_boot=60, seed=0, chunk_size=25)
+    assert a.shape == (60, 4, 3)
+    assert b.shape == (60, 3, 3)
+    assert s.shape == (60, 3)
+    # first mode is stable: aligned in sign and order with the full sample
+    assert (np.einsum("bp,p->b", a[:, :, 0], a_ref[:, 0]) > 0).all()
+    low, high = np.percentile(s[:, 0], [2.5, 97.5])
+    assert low < s_ref[0] < high
+
+    parallel = bootstrap_cca(X, Y, n_boot=60, seed=0, chunk_size=25, workers=2)
+    for res, ref in zip(parallel, (a, b, s)):
+        np.testing.assert_allclose(res, ref)
+
+
+def test_bootstrap_cca_centred():
+    X, Y = _data()
+    a_ref, b_ref, _ = cca(X, Y)
+    _, _, s = _bootstrap_chunk(X, Y, a_ref, b_ref, 0, 20)
+    idx = np.random.default_rng(0).integers(0, X.shape[0], size=(20, X.shape[0]))
+    for i, sample in enumerate(idx):
+        Xb, Yb = X[sample], Y[sample]
+        _, _, expected = cca(Xb - Xb.mean(axis=0), Yb - Yb.mean(axis=0))
+        np.testing.assert_allclose(np.sort(s[i]), np.sort(expected))
+
+
+def test_cca_uncentred():
+    X, Y = _data(300)
+    for res, ref in zip(cca(X + 5, Y + 3), cca(X, Y)):
+        np.testing.assert_allclose(res, ref, atol=1e-10)
+    _, _, s_ref = cca(X, Y)
+    _, _, s = bootstrap_cca(X + 5, Y + 3, n_boot=100, seed=0)
+    assert abs(s[:, 0].mean() - s_ref[0]) < 0.05
+    s, p, _ = permutation_cca(X + 5, Y + 3, n_perm=100, seed=0)
+    np.testing.assert_allclose(s, s_ref)
+    assert p[0] < 0.05
+
+
+def test_permutation_cca():
+    X, Y = _data()
+    s, p_values, null = permutation_cca(X, Y, n_perm=200, seed=0)
+    assert null.shape == (200, 3)
+    assert p_values[0] == pytest.approx(1 / 201)
+    assert (p_values > 0).all()
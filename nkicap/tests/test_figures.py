@@ -0,0 +1,103 @@
+import importlib
+import json
+import os
+import sys
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from ..figures import figure_job, job_key, run_figures
+
+
+def _plot_line(df, title="line"):
+    fig = plt.figure()
+    plt.plot(df["x"], df["y"])
+    plt.title(title)
+    return fig
+
+
+def _plot_current(values):
+    plt.figure()
+    plt.hist(values)
+
+
+def _plot_backend():
+    assert plt.get_backend().lower() == "agg"
+    plt.figure()
+
+
+def test_job_key():
+    df = pd.DataFrame({"x": np.arange(5), "y": np.arange(5) ** 2})
+    job = figure_job("a.png", _plot_line, df, title="a")
+    assert job_key(job) == job_key(
+        figure_job("a.png", _plot_line, df.copy(), title="a")
+    )
+    assert job_key(job) != job_key(figure_job("a.png", _plot_line, df, title="b"))
+    assert job_key(job) != job_key(figure_job("a.png", _plot_line, df + 1, title="a"))
+    assert job_key(job) != job_key(figure_job("a.png", _plot_current, df, title="a"))
+    assert job_key(job) != job_key(figure_job("a.png", _plot_line, df, dpi=100))
+
+
+def test_job_key_helper(tmp_path, monkeypatch):
+    source = """
+import matplotlib.pyplot as plt
+
+
+def _label():
+    return "{}"
+
+
+def plot(values):
+    plt.figure()
+    plt.title(_label())
+"""
+    module = tmp_path / "plot_helper.py"
+    module.write_text(source.format("a"))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    plot_helper = importlib.import_module("plot_helper")
+    job = figure_job("a.png", plot_helper.plot, [1, 2])
+    key = job_key(job)
+    assert job_key(job) == key
+
+    # editing the helper changes the key of the figure
+    module.write_text(source.format("b"))
+    os.utime(module, (0, 1))
+    assert job_key(job) != key
+    del sys.modules["plot_helper"]
+
+
+def test_run_figures(tmp_path):
+    df = pd.DataFrame({"x": np.arange(5), "y": np.arange(5) ** 2})
+    jobs = [
+        figure_job(tmp_path / "line.png", _plot_line, df, dpi=50),
+        figure_job(tmp_path / "hist" / "hist.svg", _plot_current, np.arange(10)),
+    ]
+    manifest = tmp_path / "figures.json"
+    status = run_figures(jobs, manifest, workers=2)
+    assert (status["status"] == "rendered").all()
+    assert (tmp_path / "hist" / "hist.svg").exists()
+    records = json.loads(manifest.read_text())
+    assert records[str(tmp_path / "line.png")]["key"] == status["key"].iloc[0]
+    assert records[str(tmp_path / "line.png")]["function"].endswith("_plot_line")
+
+    # only the figure with new data is rendered again
+    jobs[0] = figure_job(tmp_path / "line.png", _plot_line, df * 2, dpi=50)
+    status = run_figures(jobs, manifest)
+    assert status["status"].tolist() == ["rendered", "skipped"]
+    assert run_figures(jobs, manifest)["status"].tolist() == ["skipped"] * 2
+
+    # missing outputs and force render again
+    (tmp_path / "line.png").unlink()
+    assert run_figures(jobs, manifest)["status"].tolist() == ["rendered", "skipped"]
+    assert (run_figures(jobs, manifest, force=True)["status"] == "rendered").all()
+
+    # serial rendering is on Agg too, the backend is restored after
+    backend = plt.get_backend()
+    plt.switch_backend("svg")
+    try:
+        job = figure_job(tmp_path / "backend.png", _plot_backend)
+        run_figures([job], manifest, workers=1)
+        assert plt.get_backend() == "svg"
+    finally:
+        plt.switch_backend(backend)
@@ -0,0 +1,154 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..gradient import (
+    GradientSpaceIndex,
+    _fetch_margulies_gradient,
+    batch_map_space,
+    cap_to_gradient,
+    load_cap_maps,
+    map_space,
+    project_to_gradient,
+)
+from .utils import get_rng, make_cap_collection
+
+
+def test_project_to_gradient():
+    rng = get_rng()
+    dm_gradient = _fetch_margulies_gradient()
+    cap_maps = rng.normal(size=(3, 2, 1054))
+    projection = project_to_gradient(cap_maps, dm_gradient)
+    assert projection.shape == (3, 2, 3)
+    # same as the per column correlation
+    for i in range(3):
+        for j in range(2):
+            expected = map_space(cap_maps[i, j], dm_gradient)
+            np.testing.assert_allclose(projection[i, j], expected)
+
+
+def test_batch_map_space():
+    rng = get_rng()
+    cap_maps = rng.normal(size=(3, 2, 1054))
+    gradient_space = batch_map_space(
+        cap_maps, ["group", "A00001", "A00002"], ["cap_01", "cap_02"]
+    )
+    assert gradient_space.shape == (6, 5)
+    assert gradient_space.columns.tolist() == [
+        "participant_id",
+        "Gradient 1",
+        "Gradient 2",
+        "Gradient 3",
+        "CAP",
+    ]
+    assert gradient_space["participant_id"].tolist()[:3] == [
+        "group",
+        "A00001",
+        "A00002",
+    ]
+    assert gradient_space["CAP"].tolist() == [1, 1, 1, 2, 2, 2]
+    pd.testing.assert_index_equal(gradient_space.index, pd.RangeIndex(6))
+
+
+def test_load_cap_maps(tmp_path):
+    _, dataset = make_cap_collection(tmp_path, [f"A0000{i}" for i in range(5)])
+    paths = list(dataset["subject"].values())
+    serial = load_cap_maps(paths)
+    parallel = load_cap_maps(paths, workers=2)
+    assert serial[0].shape == (2, 10)
+    # merged in the input order
+    np.testing.assert_array_equal(np.stack(serial), np.stack(parallel))
+
+
+def test_cap_to_gradient_cache(tmp_path):
+    cap_collection, path_cap = make_cap_collection(
+        tmp_path, ["A00001", "A00002"], n_roi=1054
+    )
+    data_path = tmp_path / "cap_gradient_space.tsv"
+
+    gradient_space = cap_to_gradient(data_path, cap_collection=cap_collection)
+    assert gradient_space.attrs["cache"] == "miss"
+    assert gradient_space.shape == (6, 5)
+    assert (tmp_path / "cap_gradient_space.json").exists()
+
+    cached = cap_to_gradient(data_path, cap_collection=cap_collection)
+    assert cached.attrs["cache"] == "hit"
+    # same rows and index whether computed or served from the cache
+    pd.testing.assert_frame_equal(cached, gradient_space, rtol=1e-12)
+
+    # changing a subject map invalidates the cache
+    pd.DataFrame(np.arange(2108).reshape(1054, 2), columns=["cap_01", "cap_02"]).to_csv(
+        path_cap["subject"]["A00002"], sep="\t"
+    )
+    cached = cap_to_gradient(data_path, cap_collection=cap_collection)
+    assert cached.attrs["cache"] == "miss"
+    cached = cap_to_gradient(data_path, cap_collection=cap_collection)
+    assert cached.attrs["cache"] == "hit"
+    # explicit invalidation
+    cached = cap_to_gradient(data_path, invalidate=True, cap_collection=cap_collection)
+    assert cached.attrs["cache"] == "miss"
+
+
+def test_cap_to_gradient_unverified(tmp_path):
+    cap_collection, path_cap = make_cap_collection(tmp_path, ["A00001"], n_roi=1054)
+    data_path = tmp_path / "cap_gradient_space.tsv"
+    cap_to_gradient(data_path, cap_collection=cap_collection)
+    os.remove(path_cap["subject"]["A00001"])
+    with pytest.warns(UserWarning):
+        cached = cap_to_gradient(data_path, cap_collection=cap_collection)
+    assert cached.attrs["cache"] == "unverified"
+    with pytest.raises(FileNotFoundError):
+        cap_to_gradient(data_path, invalidate=True, cap_collection=cap_collection)
+
+
+def test_cap_to_gradient_incremental(tmp_path):
+    cap_collection, path_cap = make_cap_collection(
+        tmp_path, ["A00001", "A00002"], n_roi=1054
+    )
+    data_path = tmp_path / "cap_gradient_space.tsv"
+    cap_to_gradient(data_path, cap_collection=cap_collection)
+
+    # add a subject, change one and remove one
+    _, new_cap = make_cap_collection(tmp_path / "new", ["A00002", "A00003"], n_roi=1054)
+    path_cap["subject"]["A00003"] = new_cap["subject"]["A00003"]
+    path_cap["subject"]["A00002"] = new_cap["subject"]["A00002"]
+    path_cap["subject"].pop("A00001")
+    with open(cap_collection, "w") as fp:
+        json.dump(path_cap, fp)
+
+    update = cap_to_gradient(data_path, incremental=True, cap_collection=cap_collection)
+    assert update.attrs["cache"] == "incremental"
+    assert update.attrs["updated"] == ["A00002", "A00003"]
+
+    full = cap_to_gradient(data_path, invalidate=True, cap_collection=cap_collection)
+    pd.testing.assert_frame_equal(update, full)
+
+
+def test_gradient_space_index():
+    rng = get_rng()
+    subjects = [f"A{i:05d}" for i in range(50)]
+    gradient_space = batch_map_space(
+        rng.normal(size=(51, 3, 1054)),
+        ["group"] + subjects,
+        ["cap_01", "cap_02", "cap_03"],
+    )
+    index = GradientSpaceIndex(gradient_space)
+    assert index.caps == [1, 2, 3]
+
+    selected = index.select(["1", "3"])
+    space = gradient_space.reset_index(drop=True)
+    pd.testing.assert_frame_equal(selected, space[space["CAP"].isin([1, 3])])
+
+    lod = index.select([2], max_points=10)
+    assert len(lod) == 11
+    assert (lod["participant_id"] == "group").sum() == 1
+    # nested subsets
+    assert set(lod.index) <= set(index.select([2], max_points=20).index)
+    assert index.select([]).empty
+
+    density = index.density([1, 2], bins=5)
+    assert density.groupby("CAP")["count"].sum().tolist() == [50, 50]
+    assert density["Gradient 1"].between(-1, 1).all()
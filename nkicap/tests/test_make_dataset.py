@@ -0,0 +1,141 @@
+import importlib.util
+import sys
+
+import numpy as np
+import pytest
+from scipy import io
+
+from ..utils import get_project_path
+from .utils import get_rng
+
+h5py = pytest.importorskip("h5py")
+
+
+def _make_dataset():
+    path = get_project_path() / "bin" / "make_dataset.py"
+    spec = importlib.util.spec_from_file_location("make_dataset", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _source(n_subjects=3, n_roi=6, n_caps=4):
+    rng = get_rng(0)
+    return {
+        "subjects": [f"A{i:08d}" for i in range(n_subjects)],
+        "occurence_rate": rng.random((n_caps, n_subjects)),
+        "duration": rng.random((n_caps, n_subjects)),
+        "map_group": rng.normal(size=(n_roi, n_caps)),
+        "age": rng.integers(18, 85, n_subjects).astype(float),
+        "sex": rng.integers(0, 2, n_subjects).astype(float),
+        "transition": [rng.random((n_caps, n_caps)) for _ in range(n_subjects)],
+        "map_sub": [rng.normal(size=(n_roi, n_caps)) for _ in range(n_subjects)],
+    }
+
+
+def _write_v73(path, source):
+    """Write the source struct as MATLAB v7.3 does: transposed, cells as refs."""
+
+    def array(group, name, value):
+        dset = group.create_dataset(name, data=np.asarray(value).T)
+        dset.attrs["MATLAB_class"] = np.bytes_("double")
+        return dset
+
+    def char(group, name, value):
+        dset = group.create_dataset(
+            name, data=np.array([[ord(c)] for c in value], dtype=np.uint16)
+        )
+        dset.attrs["MATLAB_class"] = np.bytes_("char")
+        return dset
+
+    with h5py.File(path, "w", userblock_size=512) as f:
+        refs = f.create_group("#refs#")
+        struct = f.create_group("CAP_results")
+        for key, value in source.items():
+            if isinstance(value, list):
+                write = char if key == "subjects" else array
+                cells = [
+                    write(refs, f"{key}_{i}", item).ref for i, item in enumerate(value)
+                ]
+                struct.create_dataset(
+                    key, data=np.array([cells], dtype=h5py.ref_dtype).T
+                )
+            else:
+                array(struct, key, value)
+    # MAT-file header in the user block, version 0x0200 and endian indicator
+    with open(path, "r+b") as f:
+        f.write(b"MATLAB 7.3 MAT-file".ljust(116) + bytes(8) + b"\x00\x02IM")
+
+
+def _write_v5(path, source):
+    struct = dict(source)
+    for key in ["subjects", "transition", "map_sub"]:
+        # cell arrays
+        struct[key] = np.empty(len(source[key]), dtype=object)
+        for i, value in enumerate(source[key]):
+            struct[key][i] = value
+    io.savemat(path, {"CAP_results": struct})
+
+
+def _stream(make_dataset, path, n_subjects=3):
+    store = np.zeros((n_subjects, 6, 4))
+    transitions = np.zeros((n_subjects, 4, 4))
+    with make_dataset.open_source(path) as (fields, subjects):
+        frames = list(make_dataset._stream_subjects(subjects, store, transitions))
+    return fields, frames, store, transitions
+
+
+def _assert_same_source(streamed, expected):
+    fields, frames, store, transitions = streamed
+    assert list(fields["subjects"]) == list(expected[0]["subjects"])
+    for key in ["occurence_rate", "duration", "map_group", "age", "sex"]:
+        np.testing.assert_allclose(fields[key], expected[0][key])
+    assert len(frames) == len(expected[1]) == 3
+    for (sub, transit, capmap), (sub_ref, transit_ref, capmap_ref) in zip(
+        frames, expected[1]
+    ):
+        assert sub == sub_ref
+        np.testing.assert_allclose(transit, transit_ref)
+        np.testing.assert_allclose(capmap, capmap_ref)
+    np.testing.assert_allclose(store, expected[2])
+    np.testing.assert_allclose(transitions, expected[3])
+
+
+def test_open_source(tmp_path):
+    make_dataset = _make_dataset()
+    source = _source()
+    _write_v73(tmp_path / "v73.mat", source)
+    _write_v5(tmp_path / "v5.mat", source)
+
+    streamed = _stream(make_dataset, tmp_path / "v73.mat")
+    with pytest.warns(UserWarning, match="loaded whole"):
+        v5 = _stream(make_dataset, tmp_path / "v5.mat")
+    _assert_same_source(streamed, v5)
+    assert list(streamed[0]["subjects"]) == source["subjects"]
+    for key in ["occurence_rate", "duration", "map_group", "age", "sex"]:
+        np.testing.assert_allclose(streamed[0][key], source[key])
+    np.testing.assert_allclose(streamed[3], np.stack(source["transition"]))
+
+
+def test_convert_source(tmp_path):
+    make_dataset = _make_dataset()
+    source = _source()
+    _write_v5(tmp_path / "v5.mat", source)
+    converted = make_dataset.convert_source(tmp_path / "v5.mat", tmp_path / "v73.mat")
+    assert h5py.is_hdf5(converted)
+    # recognised as v7.3 by scipy, from the MAT-file header
+    with pytest.raises(NotImplementedError):
+        io.loadmat(converted)
+    with pytest.warns(UserWarning):
+        v5 = _stream(make_dataset, tmp_path / "v5.mat")
+    _assert_same_source(_stream(make_dataset, converted), v5)
+
+
+def test_open_source_without_h5py(tmp_path, monkeypatch):
+    make_dataset = _make_dataset()
+    path = tmp_path / "v73.mat"
+    _write_v73(path, _source())
+    monkeypatch.setitem(sys.modules, "h5py", None)
+    with pytest.raises(ImportError, match="nkicap\\[matlab\\]"):
+        with make_dataset.open_source(path):
+            pass
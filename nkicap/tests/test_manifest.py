@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..manifest import Manifest
+from .utils import make_cap_collection
+
+
+def test_manifest(tmp_path):
+    subjects = ["A00001", "A00002", "A00003"]
+    _, dataset = make_cap_collection(tmp_path, subjects, relative_to=tmp_path)
+    manifest = Manifest(dataset, root=tmp_path).record()
+    assert "files" not in dataset
+    record = manifest.files["sub-A00001/sub-A00001_desc-capmap_bold.tsv"]
+    assert record["shape"] == [10, 2]
+    assert set(record) == {"size", "mtime", "sha256", "shape"}
+    assert manifest.resolved()["group"] == str(tmp_path / "group.tsv")
+    manifest.validate()
+
+    manifest.save(tmp_path / "cap.json")
+    manifest = Manifest.load(tmp_path / "cap.json", root=tmp_path)
+    for prefetch in [0, 2]:
+        loaded = list(manifest.iter_subjects(prefetch=prefetch))
+        assert [sub for sub, _ in loaded] == subjects
+        for sub, cap_map in loaded:
+            path = tmp_path / manifest.dataset["subject"][sub]
+            np.testing.assert_array_equal(
+                cap_map, pd.read_csv(path, sep="\t", index_col=0).values.T
+            )
+
+
+def test_manifest_invalid(tmp_path):
+    subjects = ["A00001", "A00002", "A00003"]
+    _, dataset = make_cap_collection(tmp_path, subjects, relative_to=tmp_path)
+    manifest = Manifest(dataset, root=tmp_path).record()
+    paths = {sub: tmp_path / path for sub, path in manifest.dataset["subject"].items()}
+
+    # same size and modification time, only caught by the checksum
+    stat = os.stat(paths["A00001"])
+    content = paths["A00001"].read_bytes()
+    paths["A00001"].write_bytes(content[:-2] + b"9\n")
+    os.utime(paths["A00001"], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    manifest.validate()
+    with pytest.raises(ValueError, match="sha256"):
+        manifest.validate(checksum=True)
+
+    paths["A00002"].unlink()
+    pd.DataFrame(np.ones((12, 2))).to_csv(paths["A00003"], sep="\t")
+    manifest = Manifest(manifest.dataset, root=tmp_path)
+    with pytest.raises(ValueError, match="2 invalid") as error:
+        manifest.validate()
+    assert "A00002_desc-capmap_bold.tsv: missing" in str(error.value)
+    assert "A00003_desc-capmap_bold.tsv: shape (12, 2) != (10, 2)" in str(error.value)
+    # the problem is raised before anything is loaded
+    subjects = manifest.iter_subjects(["A00001", "A00002"])
+    with pytest.raises(ValueError, match="missing"):
+        next(subjects)
+    # files without a record are checked when loaded
+    del manifest.files[manifest.dataset["subject"]["A00003"]]
+    with pytest.raises(ValueError, match="ROI"):
+        list(manifest.iter_subjects(["A00003"]))
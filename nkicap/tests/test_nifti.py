@@ -0,0 +1,174 @@
+from pathlib import Path
+
+import nibabel as nb
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..nifti import (
+    ParcelIndex,
+    cap_to_nifti,
+    combine_atlases,
+    export_subject_niftis,
+    load_parcel_index,
+    paint_parcels,
+    parcel_index_path,
+    parcel_lut,
+)
+from ..utils import get_project_path, read_tsv
+from .utils import get_rng, make_cap_collection
+
+
+def _atlas():
+    rng = get_rng()
+    labels = rng.integers(0, 6, size=(4, 5, 6))
+    return nb.Nifti1Image(labels.astype(np.float32), affine=np.eye(4))
+
+
+def _cap_values():
+    return pd.DataFrame(
+        np.arange(10, dtype=float).reshape(5, 2) + 1,
+        index=range(1, 6),
+        columns=["cap_01", "cap_02"],
+    )
+
+
+def test_parcel_lut():
+    lut = parcel_lut(_cap_values())
+    assert lut.shape == (6, 2)
+    assert (lut[0] == 0).all()
+    assert lut[5, 1] == 10
+
+
+def test_paint_parcels():
+    labels = np.asarray(_atlas().dataobj).astype(int)
+    cap_values = _cap_values()
+    painted = paint_parcels(labels, cap_values)
+    assert painted.shape == (4, 5, 6, 2)
+    # same as masking each parcel in turn
+    for i, cap in enumerate(cap_values):
+        expected = np.zeros(labels.shape)
+        for parcel in cap_values.index:
+            expected[labels == parcel] = cap_values.loc[parcel, cap]
+        np.testing.assert_array_equal(painted[..., i], expected)
+
+
+def test_cap_to_nifti():
+    atlas = _atlas()
+    img = cap_to_nifti(atlas, _cap_values())
+    assert img.shape == (4, 5, 6, 2)
+    imgs = cap_to_nifti(atlas, _cap_values(), split=True)
+    assert len(imgs) == 2
+    assert imgs[1].shape == (4, 5, 6)
+    np.testing.assert_array_equal(imgs[1].get_fdata(), img.get_fdata()[..., 1])
+
+
+def test_cap_to_nifti_integer_atlas(tmp_path):
+    # atlases are saved as integers, see combine_atlases
+    atlas = nb.Nifti1Image(np.asarray(_atlas().dataobj).astype(np.uint16), np.eye(4))
+    cap_values = _cap_values() / 7
+    for img in [cap_to_nifti(atlas, cap_values)] + cap_to_nifti(
+        atlas, cap_values, split=True
+    ):
+        assert img.get_data_dtype() == np.float32
+        img.to_filename(tmp_path / "cap.nii.gz")
+        np.testing.assert_allclose(
+            nb.load(tmp_path / "cap.nii.gz").get_fdata(), img.get_fdata(), rtol=1e-6
+        )
+
+
+def test_export_subject_niftis(tmp_path, monkeypatch):
+    atlas_path = tmp_path / "atlas.nii.gz"
+    # integer atlas, as saved by combine_atlases
+    atlas = nb.Nifti1Image(np.asarray(_atlas().dataobj).astype(np.uint16), np.eye(4))
+    atlas.to_filename(atlas_path)
+    # paths relative to the project, as in cap.json
+    cap_collection, dataset = make_cap_collection(
+        tmp_path,
+        ["A00001", "A00002", "A00003"],
+        n_roi=5,
+        relative_to=get_project_path(),
+    )
+    # run from another directory
+    (tmp_path / "elsewhere").mkdir()
+    monkeypatch.chdir(tmp_path / "elsewhere")
+
+    out_dir = tmp_path / "out"
+    outputs = export_subject_niftis(out_dir, cap_collection, atlas_path, workers=2)
+    assert list(outputs) == ["A00001", "A00002", "A00003"]
+    img = nb.load(outputs["A00002"][0])
+    assert img.shape == (4, 5, 6, 2)
+    assert img.get_data_dtype() == np.float32
+    cap_values = read_tsv(
+        get_project_path() / dataset["subject"]["A00002"], index_col=0
+    )
+    expected = cap_to_nifti(_atlas(), cap_values)
+    np.testing.assert_allclose(img.get_fdata(), expected.get_fdata(), rtol=1e-6)
+
+    outputs = export_subject_niftis(out_dir, cap_collection, atlas_path, split=True)
+    assert [Path(f).name for f in outputs["A00001"]] == [
+        "sub-A00001_desc-cap01_bold.nii.gz",
+        "sub-A00001_desc-cap02_bold.nii.gz",
+    ]
+
+    # missing files are found before anything is exported
+    (get_project_path() / dataset["subject"]["A00003"]).unlink()
+    with pytest.raises(ValueError, match="A00003_desc-capmap_bold.tsv: missing"):
+        export_subject_niftis(tmp_path / "new", cap_collection, atlas_path)
+    assert not (tmp_path / "new").exists()
+
+
+def test_parcel_index(tmp_path):
+    labels = np.asarray(_atlas().dataobj).astype(int)
+    index = ParcelIndex.from_labels(labels)
+    assert index.parcels.tolist() == [1, 2, 3, 4, 5]
+    assert index.counts.sum() == (labels > 0).sum()
+    np.testing.assert_array_equal(
+        np.sort(index.voxels(3)), np.flatnonzero(labels.ravel() == 3)
+    )
+    np.testing.assert_array_equal(index.mask([2, 4]), np.isin(labels, [2, 4]))
+    pytest.raises(KeyError, index.voxels, 6)
+
+    cap_values = _cap_values()
+    painted = index.paint(cap_values.values)
+    np.testing.assert_array_equal(painted, paint_parcels(labels, cap_values))
+    np.testing.assert_allclose(index.summarize(painted), cap_values.values)
+    np.testing.assert_allclose(index.summarize(painted[..., 0]), cap_values["cap_01"])
+
+    atlas_path = tmp_path / "atlas.nii.gz"
+    _atlas().to_filename(atlas_path)
+    loaded = load_parcel_index(atlas_path)
+    assert parcel_index_path(atlas_path).name == "atlas_index.npz"
+    assert parcel_index_path(atlas_path).exists()
+    loaded = load_parcel_index(atlas_path)
+    np.testing.assert_array_equal(loaded.offsets, index.offsets)
+    assert loaded.shape == index.shape
+
+
+def test_combine_atlases():
+    first = np.zeros((4, 5, 6))
+    first[:2] = 1
+    first[2:, :2] = 2
+    second = np.zeros((4, 5, 6))
+    second[3:] = 1
+    third = np.zeros((4, 5, 6))
+    third[0, :, 3] = 3
+    imgs = [nb.Nifti1Image(i, affine=np.eye(4)) for i in [first, second, third]]
+
+    with pytest.warns(UserWarning):
+        combined, overlap = combine_atlases(*imgs, slab_size=4)
+    combined = np.asarray(combined.dataobj)
+    overlap = np.asarray(overlap.dataobj)
+    assert combined.dtype == np.uint8
+    # second atlas shifted by 2, third by 3
+    assert combined[3, 3, 0] == 3
+    assert combined[2, 0, 0] == 2
+    assert combined[1, 0, 3] == 1
+    # overlapping voxels are removed
+    assert overlap.sum() == 2 * 6 + 5
+    assert (combined[overlap > 0] == 0).all()
+    assert combined[0, 0, 3] == 0
+
+    combined, overlap = combine_atlases(imgs[0], nb.Nifti1Image(third * 0, np.eye(4)))
+    assert overlap is None
+    np.testing.assert_array_equal(combined.dataobj, first)
@@ -1,5 +1,17 @@
-from ..plotting import CoefficientColor, CoefficientWordCloud, _get_color_hex
-from .utils import get_test_data_path
+import sys
+
+import numpy as np
+
+from ..plotting import (
+    CoefficientColor,
+    CoefficientWordCloud,
+    _colormap_lut,
+    _get_color_hex,
+    _rescale,
+    coefficient_colors,
+    render_wordclouds,
+)
+from .utils import get_rng, get_test_data_path
 
 testdata = f"{get_test_data_path()}/font.ttf"
 
@@ -37,7 +49,61 @@ def test_coefficent_color():
     assert color_word("a") == _get_color_hex(1.0, "RdBu_r")
 
 
+def test_coefficient_colors():
+    rng = get_rng()
+    values = np.append(rng.normal(size=1000), [0, -5, 5])
+    colors = coefficient_colors(values, cmap="PiYG")
+    expected = [_get_color_hex(_rescale(v, 5), "PiYG") for v in values]
+    assert colors.tolist() == expected
+    # the lookup table is built once per color map
+    assert _colormap_lut("PiYG") is _colormap_lut("PiYG")
+    assert len(_colormap_lut("PiYG")) == 257
+    # values beyond vmax take the colors at the ends
+    colors = coefficient_colors([-10, 10], cmap="PiYG", vmax=1)
+    assert colors.tolist() == [_get_color_hex(v, "PiYG") for v in [0.0, 1.0]]
+
+
 def test_overwrite_font():
     # over write font by user
     wc = CoefficientWordCloud(font_path=testdata)
     assert "font.ttf" in wc.font_path
+
+
+def test_render_wordclouds(tmp_path):
+    panels = {
+        "mode_01": {"a": 0.7, "b": -0.3, "c": 0.1},
+        "mode_02": {"a": -0.2, "b": 0.9, "d": 0.4},
+        "mode_03": {"c": 0.5, "d": -0.6},
+    }
+    for workers in [1, 2]:
+        out_dir = tmp_path / str(workers)
+        saved = render_wordclouds(panels, out_dir, workers=workers)
+        assert list(saved) == list(panels)
+        for name, paths in saved.items():
+            assert [p.name for p in paths] == [f"{name}.png", f"{name}.svg"]
+            assert all(p.stat().st_size > 0 for p in paths)
+        svg = (out_dir / "mode_02.svg").read_text()
+        assert ">b</text>" in svg
+        assert CoefficientColor(panels["mode_02"])("b") in svg
+
+
+def test_render_wordclouds_fonts(tmp_path, monkeypatch):
+    from PIL import ImageFont
+
+    from .. import plotting
+
+    loaded = []
+    truetype = ImageFont.truetype
+
+    def counted(font, size=10, *args, **kwargs):
+        loaded.append(size)
+        return truetype(font, size, *args, **kwargs)
+
+    panels = {f"mode_{i}": {"a": 0.7, "b": -0.3, "c": 0.1, "d": 0.5} for i in range(3)}
+    plotting._truetype.cache_clear()
+    monkeypatch.setattr(ImageFont, "truetype", counted)
+    render_wordclouds(panels, tmp_path)
+    # each size is loaded once, for all the words and panels
+    assert len(loaded) == len(set(loaded))
+    # wordcloud is left as it was
+    assert sys.modules["wordcloud.wordcloud"].ImageFont is ImageFont
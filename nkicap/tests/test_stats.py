@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import spearmanr
+
+from ..stats import adjust_pvalues, manova, mass_univariate_ols, permutation_corr
+from .utils import get_rng, make_correlated
+
+
+def _data(n=50):
+    x, y = make_correlated(n, 3, 2)
+    return (
+        pd.DataFrame(x, columns=["a", "b", "c"]),
+        pd.DataFrame(y, columns=["d", "e"]),
+    )
+
+
+def test_permutation_corr():
+    x, y = _data()
+    r, p, p_fwer = permutation_corr(x, y, n_perm=500, seed=0)
+    assert r.shape == (3, 2)
+    assert r.index.tolist() == ["a", "b", "c"]
+    np.testing.assert_allclose(r.values, np.corrcoef(x.T, y.T)[:3, 3:])
+    assert p.loc["a", "d"] == 1 / 501
+    assert (p_fwer >= p).all().all()
+    assert p_fwer.loc["b", "e"] > 0.05
+
+    r, _, _ = permutation_corr(x, y, n_perm=10, method="spearman")
+    np.testing.assert_allclose(r.values, spearmanr(x, y)[0][:3, 3:])
+    pytest.raises(ValueError, permutation_corr, x, y, method="kendall")
+
+
+def test_permutation_corr_reproducible():
+    x, y = _data()
+    serial = permutation_corr(x, y, n_perm=250, seed=1, chunk_size=50)
+    parallel = permutation_corr(x, y, n_perm=250, seed=1, chunk_size=50, workers=2)
+    for a, b in zip(serial, parallel):
+        pd.testing.assert_frame_equal(a, b)
+
+
+def test_adjust_pvalues():
+    from statsmodels.stats.multitest import multipletests
+
+    rng = get_rng()
+    pvalues = rng.random((4, 6)) ** 3
+    for method in ["bonferroni", "fdr_bh"]:
+        adjusted = adjust_pvalues(pvalues, method)
+        for row, expected in zip(adjusted, pvalues):
+            np.testing.assert_allclose(row, multipletests(expected, method=method)[1])
+    pytest.raises(ValueError, adjust_pvalues, pvalues, "holm")
+
+
+def test_mass_univariate_ols():
+    import statsmodels.api as sm
+
+    x, y = _data()
+    results = mass_univariate_ols(y, x)
+    assert results["params"].shape == (2, 4)
+    assert results["params"].columns.tolist() == ["Intercept", "a", "b", "c"]
+    for dv in y:
+        fit = sm.OLS(y[dv], sm.add_constant(x)).fit()
+        for key in ["params", "bse", "tvalues", "pvalues"]:
+            np.testing.assert_allclose(
+                results[key].loc[dv].values, getattr(fit, key).values, rtol=1e-8
+            )
+
+
+def test_mass_univariate_ols_collinear():
+    import statsmodels.api as sm
+
+    # occurrence rates sum to one, collinear with the intercept
+    rng = get_rng(0)
+    x = pd.DataFrame(rng.dirichlet(np.ones(4), size=60), columns=list("abcd"))
+    y = pd.DataFrame({"e": x["a"] + rng.normal(size=60)})
+    results = mass_univariate_ols(y, x)
+    fit = sm.OLS(y["e"], sm.add_constant(x)).fit()
+    assert np.abs(results["params"].values).max() < 10
+    for key in ["params", "bse", "tvalues", "pvalues"]:
+        np.testing.assert_allclose(
+            results[key].loc["e"].values, getattr(fit, key).values, rtol=1e-6
+        )
+
+
+def test_manova():
+    from statsmodels.multivariate.manova import MANOVA
+
+    x, y = _data()
+    results = manova(y, x)
+    expected = MANOVA(y, x).mv_test().summary_frame
+    assert results.index.get_level_values("Effect").unique().tolist() == ["a", "b", "c"]
+    np.testing.assert_allclose(
+        results.iloc[:, :5].values, expected.values.astype(float), rtol=1e-8
+    )
+
+    results = manova(y, x, n_perm=200, seed=0)
+    p_perm = results.xs("Wilks' lambda", level="Statistic")["Perm. Pr"]
+    assert p_perm["a"] < 0.01
+    assert p_perm["b"] > 0.01
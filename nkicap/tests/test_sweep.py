@@ -0,0 +1,86 @@
+from pathlib import Path
+
+import pandas as pd
+
+from ..stats import manova
+from ..sweep import fit_job, job_name, load_results, make_grid, run_sweep
+from ..utils import Data
+from .utils import get_rng, get_test_data_path, make_cap_summary
+
+MRIQ_LABEL = Path(get_test_data_path()) / "mriq.tsv"
+
+
+def _make_data(tmp_path, n=40):
+    rng = get_rng()
+    df = make_cap_summary(n, 4, measures=("occ", "dur"), rng=rng)
+    for i in range(1, 4):
+        df[f"mriq_0{i}"] = rng.normal(size=n)
+    df["age"] = rng.integers(20, 80, n)
+    df.to_csv(tmp_path / "data.tsv", sep="\t")
+    return Data(tmp_path / "data.tsv", MRIQ_LABEL, mriq_labeltype="label")
+
+
+def _occ_pairs(data):
+    occ = data.load("occ")
+    return (occ["occ_cap_01"] - occ["occ_cap_02"]).to_frame("occ_cap_01_02")
+
+
+def test_run_sweep(tmp_path):
+    data = _make_data(tmp_path)
+    jobs = make_grid(
+        ["mriq_"],
+        ["occ", "dur", "pairs", "blah"],
+        covariates=[None, ["age"]],
+        mriq_drop=[None, ["mriq_03"]],
+    )
+    assert len(jobs) == 16
+    assert len({job_name(job) for job in jobs}) == 16
+
+    out_dir = tmp_path / "sweep"
+    data.load("occ", transform="zscore")
+    status = run_sweep(data, jobs, out_dir, sets={"pairs": _occ_pairs})
+    # the jobs leave the shared instance and its cached views untouched
+    assert data.mriq_drop is None
+    assert len(data._transformed) == 1
+    failed = status.index.str.contains("blah")
+    assert (status.loc[failed, "status"] == "failed").all()
+    assert (status.loc[~failed, "status"] == "done").all()
+
+    results = load_results(out_dir)
+    job = make_grid(["mriq_"], ["dur"], mriq_drop=[["mriq_03"]])[0]
+    endog = data.load("mriq_").drop(columns="mriq_03")
+    exog = data.load("dur")
+    expected = manova(
+        (endog - endog.mean()) / endog.std(ddof=0),
+        (exog - exog.mean()) / exog.std(ddof=0),
+    )
+    pd.testing.assert_frame_equal(
+        results.loc[job_name(job)], expected, check_dtype=False
+    )
+    params = load_results(out_dir, "params")
+    assert params.loc[job_name(job)].index.tolist() == ["mriq_01", "mriq_02"]
+
+    # only the failed jobs are rerun
+    mtimes = {path: path.stat().st_mtime_ns for path in status["path"]}
+    run_sweep(data, jobs, out_dir, sets={"pairs": _occ_pairs}, workers=2)
+    for name, path in status["path"].items():
+        assert (path.stat().st_mtime_ns == mtimes[path]) != ("blah" in name)
+
+
+def test_fit_job_lazy(tmp_path):
+    data = _make_data(tmp_path)
+    lazy = Data(
+        tmp_path / "data.tsv",
+        MRIQ_LABEL,
+        mriq_labeltype="label",
+        lazy=True,
+    )
+    job = make_grid(["mriq_"], ["occ"], covariates=[["age"]])[0]
+    result = fit_job(lazy, job)
+    # the covariates are read alone, not with every column of the dataset
+    assert sorted(lazy._dataset.columns) == sorted(
+        data.load("mriq_").columns.tolist()
+        + data.load("occ").columns.tolist()
+        + ["age"]
+    )
+    assert result == fit_job(data, job)
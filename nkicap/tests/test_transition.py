@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+from ..manifest import Manifest
+from ..transition import (
+    corr_mriq,
+    entropy_rate,
+    group_average,
+    load_transitions,
+    stationary_distribution,
+    transition_metrics,
+    transition_paths,
+    transition_probability,
+)
+from ..utils import save_cap_store
+from .utils import get_rng, make_cap_collection
+
+
+def _transitions(n=20, k=8):
+    return get_rng().integers(1, 50, size=(n, k, k)).astype(float)
+
+
+def test_stationary_distribution():
+    prob = transition_probability(_transitions())
+    np.testing.assert_allclose(prob.sum(axis=-1), 1)
+    pi = stationary_distribution(prob)
+    np.testing.assert_allclose(np.einsum("ni,nij->nj", pi, prob), pi, atol=1e-12)
+    np.testing.assert_allclose(pi[0], np.linalg.matrix_power(prob[0], 200)[0])
+
+    expected = [
+        -sum(p[i] * row @ np.log2(row) for i, row in enumerate(m))
+        for p, m in zip(pi, prob)
+    ]
+    np.testing.assert_allclose(entropy_rate(prob), expected)
+
+
+def test_transition_metrics():
+    transitions = _transitions()
+    subjects = [f"A{i:05d}" for i in range(20)]
+    metrics = transition_metrics(transitions, subjects)
+    assert metrics.shape == (20, 25)
+    assert metrics.index.tolist() == subjects
+    prob = transition_probability(transitions)
+    np.testing.assert_allclose(
+        metrics["dwell_cap_03"], 1 / (1 - prob[:, 2, 2]), rtol=1e-12
+    )
+    np.testing.assert_allclose(
+        metrics["return_cap_01"] * metrics["stationary_cap_01"], 1
+    )
+    assert group_average(transitions).shape == (8, 8)
+
+    rng = get_rng(0)
+    mriq = pd.DataFrame(
+        rng.normal(size=(15, 2)), index=subjects[5:], columns=["mriq_01", "mriq_02"]
+    )
+    mriq["mriq_01"] += metrics["entropy_rate"]
+    r, _, p_fwer = corr_mriq(metrics, mriq, n_perm=100, seed=0)
+    assert r.shape == (25, 2)
+    np.testing.assert_allclose(
+        r.loc["entropy_rate", "mriq_01"],
+        np.corrcoef(metrics["entropy_rate"][5:], mriq["mriq_01"])[0, 1],
+    )
+
+
+def test_transition_metrics_unvisited():
+    transitions = _transitions(4)
+    # CAP 3 never visited by the second subject
+    transitions[1, 2, :] = transitions[1, :, 2] = 0
+    # the third subject stays in CAP 1 once there
+    transitions[2, 0, 1:] = 0
+    metrics = transition_metrics(transitions, ["A", "B", "C", "D"])
+    assert metrics.loc[["B", "C"], "stationary_cap_01"].isna().all()
+    assert metrics.loc[["B", "C"], "entropy_rate"].isna().all()
+    assert metrics.loc[["A", "D"]].notna().all().all()
+    pi = stationary_distribution(transition_probability(transitions[[0, 3]]))
+    np.testing.assert_allclose(
+        metrics.loc[["A", "D"]].filter(like="stationary").values, pi
+    )
+
+
+def test_load_transitions(tmp_path):
+    transitions = _transitions(3)
+    subjects = ["A00001", "A00002", "A00003"]
+    labels = [f"cap_{i + 1:02d}" for i in range(8)]
+    _, dataset = make_cap_collection(tmp_path, subjects, relative_to=tmp_path)
+    manifest = Manifest(dataset, root=tmp_path)
+    for path, transit in zip(transition_paths(manifest).values(), transitions):
+        pd.DataFrame(transit, index=labels, columns=labels).to_csv(path, sep="\t")
+    loaded, loaded_subjects = load_transitions(store=None, manifest=manifest)
+    assert loaded_subjects == subjects
+    np.testing.assert_allclose(loaded, transitions)
+
+    store = tmp_path / "desc-transition.npy"
+    save_cap_store(store, transitions, subjects, labels, labels)
+    loaded, _ = load_transitions(subjects[::-1], store=store, manifest=manifest)
+    np.testing.assert_allclose(loaded, transitions[::-1])
+
+    # both sources default to the subjects of the manifest, in its order
+    dataset["subject"] = {sub: dataset["subject"][sub] for sub in ["A00003", "A00001"]}
+    manifest = Manifest(dataset, root=tmp_path)
+    from_store = load_transitions(store=store, manifest=manifest)
+    from_tsv = load_transitions(store=None, manifest=manifest, workers=2)
+    for loaded, loaded_subjects in [from_store, from_tsv]:
+        assert loaded_subjects == ["A00003", "A00001"]
+        np.testing.assert_allclose(loaded, transitions[[2, 0]])
@@ -1,9 +1,21 @@
+import shutil
+import sys
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 import pytest
 
-from ..utils import Data, get_project_path, read_tsv
-from .utils import get_test_data_path
+from ..utils import (
+    CAPStore,
+    Data,
+    cap_contrasts,
+    get_project_path,
+    parquet_path,
+    read_tsv,
+    save_cap_store,
+)
+from .utils import get_test_data_path, make_cap_summary
 
 testdata = Path(get_test_data_path()) / "file.tsv"
 testmriq = Path(get_test_data_path()) / "mriq.tsv"
@@ -26,6 +38,21 @@ def test_drop_mriq():
     assert m.shape[1] == 2
 
 
+def test_lazy_data():
+    d = Data(datapath=testdata, mriq_label=testmriq, mriq_drop=["mriq_01"])
+    lazy = Data(
+        datapath=testdata, mriq_label=testmriq, mriq_drop=["mriq_01"], lazy=True
+    )
+    assert lazy.variables == d.variables
+    assert lazy._dataset is None
+    for keyword in ["occ", "mriq_"]:
+        pd.testing.assert_frame_equal(lazy.load(keyword), d.load(keyword))
+    # only the requested columns are read
+    assert lazy._dataset.shape[1] == 6
+    pd.testing.assert_frame_equal(lazy.load(), d.load())
+    pytest.raises(KeyError, lazy.load, keyword="blah")
+
+
 def test_get_project_path():
     p = get_project_path()
     assert p.name == "nkicap"
@@ -40,3 +67,166 @@ def test_read_tsv():
     pytest.raises(ValueError, read_tsv, testcsv, index_col=0)
     pytest.warns(UserWarning, read_tsv, testcsv)
     pytest.raises(Exception, read_tsv, testcsv, sep=",")
+
+
+def test_cap_store(tmp_path):
+    maps = np.arange(2 * 5 * 3, dtype=float).reshape(2, 5, 3)
+    path = tmp_path / "desc-capmap_bold.npy"
+    save_cap_store(path, maps, ["A00123", "A00124"], range(1, 6), ["a", "b", "c"])
+    assert (tmp_path / "desc-capmap_bold.json").exists()
+
+    store = CAPStore(path)
+    assert len(store) == 2
+    assert store.roi == [1, 2, 3, 4, 5]
+    np.testing.assert_array_equal(store.subject("A00124"), maps[1])
+    np.testing.assert_array_equal(store.cap("b"), maps[:, :, 1])
+    np.testing.assert_array_equal(store.select(["A00124", "A00123"]), maps[::-1])
+    # views on the memory map, not copies
+    assert np.shares_memory(store.subject("A00123"), store.data)
+    assert np.shares_memory(store.cap("a"), store.data)
+    assert store.to_frame("A00123").loc[5, "c"] == 14
+
+
+def test_read_tsv_filters():
+    f = read_tsv(testdata, index_col=0, filters=[("age", ">=", 55)])
+    assert f.shape[0] == 3
+    f = read_tsv(
+        testdata,
+        index_col=0,
+        usecols=["participant_id", "sex"],
+        filters=[("age", "<", 55), ("sex", "in", ["F"])],
+    )
+    assert f.index.tolist() == ["A00123"]
+    assert f.columns.tolist() == ["sex"]
+    pytest.raises(ValueError, read_tsv, testdata, backend="csv")
+
+
+def test_parquet_backend(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "file.tsv"
+    shutil.copy(testdata, path)
+    tsv = read_tsv(path, index_col=0)
+    parquet = read_tsv(path, backend="parquet", index_col=0)
+    assert parquet_path(path).exists()
+    pd.testing.assert_frame_equal(parquet, tsv)
+
+    parquet = read_tsv(
+        path,
+        backend="parquet",
+        index_col=0,
+        usecols=["sex"],
+        filters=[("age", ">=", 55)],
+    )
+    assert parquet.columns.tolist() == ["sex"]
+    assert parquet.shape[0] == 3
+
+    d = Data(datapath=testdata, mriq_label=testmriq)
+    for lazy in [True, False]:
+        p = Data(datapath=path, mriq_label=testmriq, backend="parquet", lazy=lazy)
+        pd.testing.assert_frame_equal(p.load("mriq_"), d.load("mriq_"))
+        pd.testing.assert_frame_equal(p.load(), d.load())
+
+
+def test_parquet_backend_missing(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(ImportError, match="nkicap\\[parquet\\]"):
+        read_tsv(testdata, backend="parquet", index_col=0)
+    with pytest.raises(ImportError, match="pyarrow"):
+        Data(datapath=testdata, mriq_label=testmriq, backend="parquet")
+
+
+def test_load_transform():
+    from scipy.stats import rankdata, zscore
+
+    d = Data(datapath=testdata, mriq_label=testmriq, mriq_labeltype="label")
+    occ = d.load("occ", transform="zscore")
+    np.testing.assert_allclose(occ.values, zscore(d.load("occ").values))
+    mriq = d.load("mriq_", transform="rank")
+    np.testing.assert_allclose(mriq.values, rankdata(d.load("mriq_"), axis=0))
+    assert len(d._transformed) == 2
+
+    # cached views are copies
+    occ.iloc[0, 0] = 100
+    assert d.load("occ", transform="zscore").iloc[0, 0] != 100
+    assert len(d._transformed) == 2
+
+    d.mriq_drop = ["mriq_01"]
+    assert not d._transformed
+    mriq = d.load("mriq_", transform="rank")
+    assert mriq.columns.tolist() == ["mriq_02", "mriq_03"]
+    # drop list for one call, the cached views are kept
+    mriq = d.load("mriq_", transform="rank", mriq_drop=[])
+    assert mriq.columns.tolist() == ["mriq_01", "mriq_02", "mriq_03"]
+    assert d.load("mriq_", mriq_drop=["mriq_03"]).columns.tolist() == [
+        "mriq_01",
+        "mriq_02",
+    ]
+    assert d.mriq_drop == ["mriq_01"]
+    assert len(d._transformed) == 2
+    pytest.raises(ValueError, d.load, "occ", transform="log")
+
+
+def test_cap_contrasts():
+    cap = make_cap_summary(20, 12)
+    pairs = cap_contrasts(cap)
+    assert pairs.shape == (20, 12)
+    assert pairs.columns[:2].tolist() == ["dur_cap_01_02", "dur_cap_03_04"]
+    np.testing.assert_allclose(
+        pairs["occ_cap_11_12"], cap["occ_cap_11"] - cap["occ_cap_12"]
+    )
+
+    all_pairs = cap_contrasts(cap, "all_pairs", measures=("occ",))
+    assert all_pairs.shape == (20, 66)
+    np.testing.assert_allclose(
+        all_pairs["occ_cap_02_09"], cap["occ_cap_02"] - cap["occ_cap_09"]
+    )
+
+    rest = cap_contrasts(cap, "one_vs_rest")
+    others = cap.filter(like="dur_cap").drop(columns="dur_cap_03").mean(axis=1)
+    np.testing.assert_allclose(rest["dur_cap_03_rest"], cap["dur_cap_03"] - others)
+
+    matrix = pd.DataFrame(
+        {"cap_01": [1, 0.5], "cap_05": [-1, 0.5], "cap_07": [0, -1]},
+        index=["cap_01_05", "early_late"],
+    )
+    custom = cap_contrasts(cap, matrix)
+    assert custom.columns.tolist() == [
+        "dur_cap_01_05",
+        "dur_early_late",
+        "occ_cap_01_05",
+        "occ_early_late",
+    ]
+    np.testing.assert_allclose(
+        custom["occ_early_late"],
+        (cap["occ_cap_01"] + cap["occ_cap_05"]) / 2 - cap["occ_cap_07"],
+    )
+    matrix["cap_13"] = 0
+    with pytest.raises(KeyError, match="cap_13"):
+        cap_contrasts(cap, matrix)
+    # labels without padding
+    unpadded = cap.rename(columns=lambda col: col.replace("cap_0", "cap_"))
+    assert cap_contrasts(unpadded, measures=("occ",)).columns.tolist()[:2] == [
+        "occ_cap_11_12",
+        "occ_cap_1_2",
+    ]
+    pytest.raises(ValueError, cap_contrasts, make_cap_summary(20, 7))
+    pytest.raises(ValueError, cap_contrasts, cap, "random")
+
+
+def test_data_contrast():
+    d = Data(datapath=testdata, mriq_label=testmriq)
+    pairs = d.contrast()
+    assert pairs.columns.tolist() == [
+        "dur_cap_01_02",
+        "dur_cap_03_04",
+        "occ_cap_01_02",
+        "occ_cap_03_04",
+    ]
+    cap = d.load("cap")
+    np.testing.assert_allclose(
+        pairs["dur_cap_03_04"], cap["dur_cap_03"] - cap["dur_cap_04"]
+    )
+    assert len(d._transformed) == 1
+    d.contrast()
+    d.contrast("one_vs_rest")
+    assert len(d._transformed) == 2
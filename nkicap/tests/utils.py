@@ -1,6 +1,79 @@
+import json
+import os
 from os.path import join
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+
+SEED = 42
+
 
 def get_test_data_path():
     return join(Path(__file__).absolute().parent, "data")
+
+
+def get_rng(seed=SEED):
+    """Seeded random generator, the same test data on every run."""
+    return np.random.default_rng(seed)
+
+
+def make_correlated(n, n_x, n_y, rng=None):
+    """Two random arrays whose first columns share a latent variable."""
+    rng = get_rng() if rng is None else rng
+    latent = rng.normal(size=n)
+    x = rng.normal(size=(n, n_x))
+    y = rng.normal(size=(n, n_y))
+    x[:, 0] += 2 * latent
+    y[:, 0] += 2 * latent
+    return x, y
+
+
+def make_cap_summary(n, n_caps, measures=("dur", "occ"), rng=None):
+    """Random CAP measures of `n` subjects, with columns such as "occ_cap_01"."""
+    rng = get_rng() if rng is None else rng
+    columns = [f"{m}_cap_{i + 1:02d}" for m in measures for i in range(n_caps)]
+    return pd.DataFrame(
+        rng.random((n, len(columns))),
+        columns=columns,
+        index=pd.Index([f"A{i:05d}" for i in range(n)], name="participant_id"),
+    )
+
+
+def make_cap_collection(path, subjects, n_roi=10, n_caps=2, relative_to=None):
+    """
+    Write random group and subject CAP maps, and the cap.json listing them.
+
+    The maps are laid out as in the project, `path/sub-<id>/...`. The paths
+    in cap.json are relative to `relative_to`, or absolute when it is None.
+
+    Returns
+    -------
+    cap_collection : Path
+        The cap.json file, in `path`.
+
+    dataset : dict
+        Its content.
+    """
+    rng = get_rng()
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    roi = list(range(1, n_roi + 1))
+    columns = [f"cap_{i + 1:02d}" for i in range(n_caps)]
+
+    def write(filename):
+        filename.parent.mkdir(exist_ok=True)
+        cap_map = pd.DataFrame(rng.normal(size=(n_roi, n_caps)), roi, columns)
+        cap_map.to_csv(filename, sep="\t")
+        if relative_to is None:
+            return str(filename)
+        return os.path.relpath(filename, relative_to)
+
+    dataset = {"group": write(path / "group.tsv"), "subject": {}, "roi": roi}
+    for sub in subjects:
+        filename = path / f"sub-{sub}" / f"sub-{sub}_desc-capmap_bold.tsv"
+        dataset["subject"][sub] = write(filename)
+    cap_collection = path / "cap.json"
+    with open(cap_collection, "w") as fp:
+        json.dump(dataset, fp)
+    return cap_collection, dataset
@@ -0,0 +1,187 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .manifest import Manifest
+from .stats import permutation_corr
+from .utils import CAPStore, get_project_path, parallel_map
+
+TRANSITION_STORE = Path(get_project_path()) / "data/enhanced_nki/desc-transition.npy"
+
+
+def _read_transition(path):
+    """Load one transition matrix tsv, skipping the header and labels."""
+    return np.loadtxt(path, delimiter="\t", skiprows=1, dtype=str)[:, 1:].astype(float)
+
+
+def transition_paths(manifest=None):
+    """Transition matrix tsv of each subject, next to their CAP map."""
+    if manifest is None:
+        manifest = Manifest.load()
+    return {
+        sub: path.replace("desc-capmap_bold", "desc-transition")
+        for sub, path in manifest.resolved()["subject"].items()
+    }
+
+
+def load_transitions(subjects=None, store=TRANSITION_STORE, manifest=None, workers=1):
+    """
+    Load the CAP transition matrices of all subjects in one array.
+
+    Read from the memory mapped store written by `bin/make_dataset.py`
+    when it exists, otherwise from the tsv file of each subject.
+
+    Parameters
+    ----------
+    subjects : list of str, optional
+        Subjects to load, default to all the subjects of `manifest`,
+        whether they are read from the store or the tsv files.
+
+    store : str or Path, optional
+        Path to the transition matrix store, see `nkicap.CAPStore`.
+
+    manifest : nkicap.Manifest, optional
+        Dataset to find the tsv files in. Default to `data/cap.json`.
+
+    workers : int or None, optional
+        Number of processes reading the tsv files. None uses all cores.
+
+    Returns
+    -------
+    transitions : numpy.ndarray, shape (subject, cap, cap)
+        Transitions from the CAP of the row to the CAP of the column.
+
+    subjects : list of str
+    """
+    if manifest is None:
+        manifest = Manifest.load()
+    subjects = manifest.subjects if subjects is None else list(subjects)
+    if store is not None and Path(store).exists():
+        return np.asarray(CAPStore(store).select(subjects)), subjects
+
+    paths = transition_paths(manifest)
+    paths = [paths[sub] for sub in subjects]
+    return np.stack(parallel_map(_read_transition, paths, workers=workers)), subjects
+
+
+def transition_probability(transitions):
+    """Normalise the rows of the transition matrices to probabilities."""
+    transitions = np.asarray(transitions, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return transitions / transitions.sum(axis=-1, keepdims=True)
+
+
+def stationary_distribution(prob):
+    """
+    Stationary distribution of each transition probability matrix.
+
+    The left eigenvector of eigenvalue 1, from one batched eigendecomposition.
+    Matrices with an empty state, a CAP never visited, or an absorbing
+    state have no meaningful distribution and get NaN.
+
+    Parameters
+    ----------
+    prob : numpy.ndarray, shape (..., cap, cap)
+        Row stochastic transition matrices.
+
+    Returns
+    -------
+    numpy.ndarray, shape (..., cap)
+    """
+    prob = np.asarray(prob, dtype=float)
+    valid = np.isfinite(prob).all(axis=(-2, -1))
+    valid &= ~(np.diagonal(prob, axis1=-2, axis2=-1) == 1).any(axis=-1)
+    pi = np.full(prob.shape[:-1], np.nan)
+    if not valid.any():
+        return pi
+    eigval, eigvec = np.linalg.eig(np.swapaxes(prob[valid], -1, -2))
+    idx = np.abs(eigval - 1).argmin(axis=-1)
+    vec = np.take_along_axis(eigvec, idx[..., np.newaxis, np.newaxis], axis=-1)
+    vec = vec[..., 0].real
+    pi[valid] = vec / vec.sum(axis=-1, keepdims=True)
+    return pi
+
+
+def entropy_rate(prob, pi=None):
+    """Entropy rate of each Markov chain, in bits per transition."""
+    if pi is None:
+        pi = stationary_distribution(prob)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        plogp = np.where(prob > 0, prob * np.log2(prob), 0)
+    return -np.einsum("...i,...ij->...", pi, plogp)
+
+
+def dwell_time(prob):
+    """Expected number of consecutive frames spent in each CAP."""
+    with np.errstate(divide="ignore"):
+        return 1 / (1 - np.diagonal(prob, axis1=-2, axis2=-1))
+
+
+def return_time(pi):
+    """Expected number of frames before returning to each CAP."""
+    with np.errstate(divide="ignore"):
+        return 1 / pi
+
+
+def group_average(transitions):
+    """Group transition probability matrix, averaged across subjects."""
+    return np.nanmean(transition_probability(transitions), axis=0)
+
+
+def transition_metrics(transitions, subjects, cap_labels=None):
+    """
+    Markov chain dynamics of each subject.
+
+    Parameters
+    ----------
+    transitions : numpy.ndarray, shape (subject, cap, cap)
+        Transition counts or probabilities, see `load_transitions`.
+
+    subjects : list of str
+        Participant ID of each matrix.
+
+    cap_labels : list of str, optional
+        Default to "cap_01", "cap_02", ...
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per subject, with the stationary probability, dwell time and
+        return time of each CAP (such as "stationary_cap_01") and the
+        "entropy_rate".
+    """
+    if cap_labels is None:
+        cap_labels = [f"cap_{i + 1:02d}" for i in range(transitions.shape[-1])]
+    prob = transition_probability(transitions)
+    pi = stationary_distribution(prob)
+    metrics = {
+        "stationary": pi,
+        "dwell": dwell_time(prob),
+        "return": return_time(pi),
+    }
+    df = pd.concat(
+        [
+            pd.DataFrame(value, columns=[f"{name}_{cap}" for cap in cap_labels])
+            for name, value in metrics.items()
+        ],
+        axis=1,
+    )
+    df["entropy_rate"] = entropy_rate(prob, pi)
+    df.index = pd.Index(subjects, name="participant_id")
+    return df
+
+
+def corr_mriq(metrics, mriq, **kwargs):
+    """
+    Correlate transition metrics with MRIQ, with permutation inference.
+
+    Subjects present in both are used. Keyword arguments are passed to
+    `nkicap.stats.permutation_corr`.
+
+    Returns
+    -------
+    r, p_uncorrected, p_fwer : pandas.DataFrame, shape (metric, mriq)
+    """
+    subjects = metrics.dropna().index.intersection(mriq.dropna().index)
+    return permutation_corr(metrics.loc[subjects], mriq.loc[subjects], **kwargs)
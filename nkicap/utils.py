@@ -1,8 +1,26 @@
+import itertools
+import json
+import os
 import warnings
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
+# keywords indexed when the data is loaded
+KEYWORDS = ("occ", "dur", "cap", "mriq_")
+
+# derived views offered by Data.load, computed per column
+TRANSFORMS = {
+    "zscore": lambda df: (df - df.mean()) / df.std(ddof=0),
+    "rank": lambda df: df.rank(),
+}
+
+# number of derived views kept by a Data instance
+TRANSFORM_CACHE_SIZE = 16
+
 
 class Data:
     """
@@ -30,6 +48,16 @@ class Data:
         "full": full length question
         "summary": the shorten version in Wang et al.(2018)
 
+    lazy: bool, optional
+        Only read the header at construction, and read the columns
+        of each keyword on first access.
+
+    backend: str, optional
+        Storage backend of the dataset, "tsv" or "parquet". See `read_tsv`.
+
+    filters: list of tuples, optional
+        Keep the subjects matching these row filters, see `read_tsv`.
+
     References
     ----------
     Wang, et al., (2018) "Patterns of thought: Population variation in the
@@ -45,15 +73,74 @@ class Data:
         mriq_label="data/mriq_labels.tsv",
         mriq_drop=None,
         mriq_labeltype="full",
+        lazy=False,
+        backend="tsv",
+        filters=None,
     ):
         """Default parameters."""
-        self.dataset = read_tsv(datapath, index_col=0)
-        self.variables = self.dataset.columns.tolist()
+        self.datapath = datapath
+        self.lazy = lazy
+        self.backend = backend
+        self.filters = filters
+        if lazy:
+            if backend == "parquet":
+                columns = _parquet_columns(_ensure_parquet(datapath))
+            else:
+                columns = pd.read_csv(datapath, sep="\t", nrows=0).columns
+            self._index_name = columns[0]
+            self._dataset = None
+            self.variables = list(columns[1:])
+        else:
+            self._dataset = read_tsv(
+                datapath, backend=backend, filters=filters, index_col=0
+            )
+            self.variables = self._dataset.columns.tolist()
         self.mriq_label = read_tsv(mriq_label, index_col=0).T.to_dict()
+        self._transformed = OrderedDict()
         self.mriq_drop = mriq_drop
         self.mriq_labeltype = mriq_labeltype
+        self._keyword_index = {}
+        for keyword in KEYWORDS:
+            try:
+                self._fetch_keyword(keyword)
+            except KeyError:
+                pass
 
-    def load(self, keyword=None):
+    @property
+    def mriq_drop(self):
+        """MRIQ items to drop, changing it clears the cached derived views."""
+        return self._mriq_drop
+
+    @mriq_drop.setter
+    def mriq_drop(self, mriq_drop):
+        self._mriq_drop = mriq_drop
+        self._transformed.clear()
+
+    @property
+    def dataset(self):
+        """The full dataset, read on first access in lazy mode."""
+        return self._select(self.variables)
+
+    def _select(self, col):
+        """Get columns of the dataset, reading the missing ones in lazy mode."""
+        if self._dataset is None:
+            missing = col
+        else:
+            missing = [i for i in col if i not in self._dataset.columns]
+        if missing:
+            data = read_tsv(
+                self.datapath,
+                backend=self.backend,
+                filters=self.filters,
+                index_col=self._index_name,
+                usecols=[self._index_name] + missing,
+            )
+            if self._dataset is not None:
+                data = pd.concat([self._dataset, data], axis=1)
+            self._dataset = data
+        return self._dataset[col]
+
+    def load(self, keyword=None, transform=None, mriq_drop=None):
         """
         Load data from the full dataset.
 
@@ -62,37 +149,185 @@ class Data:
         keyword : str or None, optional.
             Keyword in the variable name. Pass None to retrieve the full dataset
 
+        transform : str or None, optional.
+            Derived view of the data, computed per column.
+            "zscore": z-scores, as scipy.stats.zscore.
+            "rank": ranks, ties get the average rank.
+            The views are cached, the least recently used are dropped
+            past `TRANSFORM_CACHE_SIZE`.
+
+        mriq_drop : None or list of strings, optional.
+            MRIQ items to drop for this call only, default to `mriq_drop`
+            of the instance. Pass an empty list to keep all items.
+
         Returns
         -------
         data :  pandas.DataFrame
             Retrieved data
         """
+        if mriq_drop is None:
+            mriq_drop = self.mriq_drop
+        if transform is None:
+            return self._load(keyword, mriq_drop)
+        if transform not in TRANSFORMS:
+            raise ValueError(
+                f"Unknown transform {transform}, use one of {list(TRANSFORMS)}."
+            )
+
+        drop = tuple(mriq_drop) if mriq_drop else None
+        key = (transform, tuple(self._fetch_keyword(keyword)), drop)
+        key += (self.mriq_labeltype,)
+        if key in self._transformed:
+            self._transformed.move_to_end(key)
+        else:
+            self._transformed[key] = TRANSFORMS[transform](
+                self._load(keyword, mriq_drop)
+            )
+            if len(self._transformed) > TRANSFORM_CACHE_SIZE:
+                self._transformed.popitem(last=False)
+        return self._transformed[key].copy()
+
+    def _load(self, keyword, mriq_drop=None):
+        """Columns with a keyword, with the MRIQ items dropped and relabelled."""
         col = self._fetch_keyword(keyword)
         if keyword is None or "mriq" not in keyword:
-            return self.dataset[col]
+            return self._select(col)
 
         labels = self.mriq_label.copy()
-        if self.mriq_drop is not None:
-            for label in self.mriq_drop:
+        if mriq_drop is not None:
+            for label in mriq_drop:
                 labels.pop(label)
                 col.remove(label)
 
+        data = self._select(col)
         if self.mriq_labeltype != "label":
             labels = {k: v[self.mriq_labeltype] for k, v in labels.items()}
-            data = self.dataset[col]
             data = data.rename(columns=labels)
         return data
 
+    def contrast(self, contrasts="pairs", measures=("occ", "dur")):
+        """
+        Contrasts of CAP occurence and duration, see `cap_contrasts`.
+
+        The results are cached with the derived views of `load`.
+        """
+        if isinstance(contrasts, str):
+            key = ("contrast", contrasts)
+        else:
+            contrasts = pd.DataFrame(contrasts)
+            key = ("contrast", tuple(contrasts.index), tuple(contrasts.columns))
+            key += (contrasts.values.tobytes(),)
+        key += tuple(measures)
+        if key in self._transformed:
+            self._transformed.move_to_end(key)
+        else:
+            self._transformed[key] = cap_contrasts(
+                self.load("cap"), contrasts, measures
+            )
+            if len(self._transformed) > TRANSFORM_CACHE_SIZE:
+                self._transformed.popitem(last=False)
+        return self._transformed[key].copy()
+
     def _fetch_keyword(self, keyword):
-        """Get columns with a keyword"""
+        """Get columns with a keyword, memoized per keyword."""
         if keyword is None:
-            col = self.variables
-        else:
-            col = [i for i in self.variables if keyword in i]
+            return list(self.variables)
+        if keyword not in self._keyword_index:
+            self._keyword_index[keyword] = [i for i in self.variables if keyword in i]
 
+        col = self._keyword_index[keyword]
         if not col:
             raise KeyError(f"No column with keyword {keyword} was found")
-        return col
+        return list(col)
+
+
+def _cap_number(label):
+    """Number of a CAP label, such as 2 for "cap_02" or "occ_cap_2"."""
+    return int(label.rsplit("_", 1)[-1])
+
+
+def _contrast_weights(contrasts, cap_labels):
+    """Weights, shape (contrast, CAP), and names of the contrasts."""
+    n_caps = len(cap_labels)
+    if not isinstance(contrasts, str):
+        contrasts = pd.DataFrame(contrasts)
+        unknown = [cap for cap in contrasts.columns if cap not in cap_labels]
+        if unknown:
+            raise KeyError(f"Unknown CAPs in the contrasts: {unknown}.")
+        contrasts = contrasts.reindex(columns=cap_labels, fill_value=0)
+        return contrasts.values.astype(float), list(contrasts.index)
+
+    if contrasts == "one_vs_rest":
+        weights = np.eye(n_caps) - (1 - np.eye(n_caps)) / (n_caps - 1)
+        return weights, [f"{cap}_rest" for cap in cap_labels]
+    if contrasts == "pairs":
+        if n_caps % 2:
+            raise ValueError(f"Can not pair an odd number of CAPs ({n_caps}).")
+        pairs = [(i, i + 1) for i in range(0, n_caps, 2)]
+    elif contrasts == "all_pairs":
+        pairs = list(itertools.combinations(range(n_caps), 2))
+    else:
+        raise ValueError(
+            f"Unknown contrasts {contrasts}, use 'pairs', 'all_pairs', "
+            "'one_vs_rest' or a contrast matrix."
+        )
+    first, second = np.array(pairs).T
+    weights = np.zeros((len(pairs), n_caps))
+    weights[np.arange(len(pairs)), first] = 1
+    weights[np.arange(len(pairs)), second] = -1
+    # "cap_01" and "cap_02" give "cap_01_02"
+    names = [f"{cap_labels[i]}_{cap_labels[j].rsplit('_', 1)[-1]}" for i, j in pairs]
+    return weights, names
+
+
+def cap_contrasts(cap, contrasts="pairs", measures=("occ", "dur")):
+    """
+    Contrasts between CAPs of the CAP summary statistics.
+
+    All contrasts of all measures are computed in one matrix product,
+    for any number of CAPs.
+
+    Parameters
+    ----------
+    cap: pandas.DataFrame
+        CAP summary statistics with columns such as "occ_cap_01", one row
+        per subject.
+
+    contrasts: str or pandas.DataFrame, optional
+        "pairs": differences of consecutive CAPs, 1 - 2, 3 - 4, ...
+        "all_pairs": differences of every pair of CAPs.
+        "one_vs_rest": each CAP minus the mean of the other CAPs.
+        A contrast matrix: one row per contrast, named by the index, and one
+        column per CAP such as "cap_01". Missing CAPs are weighted 0, CAPs
+        not in `cap` raise a KeyError.
+
+    measures: tuple of str, optional
+        Prefix of the statistics to contrast.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One column per measure and contrast, such as "occ_cap_01_02" or
+        "dur_cap_03_rest", in sorted order.
+    """
+    columns = [
+        sorted(
+            [col for col in cap.columns if col.startswith(f"{measure}_cap_")],
+            key=_cap_number,
+        )
+        for measure in measures
+    ]
+    cap_labels = [col[len(measures[0]) + 1 :] for col in columns[0]]
+    for measure, cols in zip(measures, columns):
+        if [col[len(measure) + 1 :] for col in cols] != cap_labels:
+            raise ValueError(f"The CAPs of {measure} differ from {measures[0]}.")
+    weights, names = _contrast_weights(contrasts, cap_labels)
+    # one block of weights per measure
+    weights = np.kron(np.eye(len(measures)), weights)
+    values = cap[list(itertools.chain(*columns))].values @ weights.T
+    names = [f"{measure}_{name}" for measure in measures for name in names]
+    diffs = pd.DataFrame(values, index=cap.index, columns=names)
+    return diffs.reindex(sorted(diffs.columns), axis=1)
 
 
 def get_project_path():
@@ -100,6 +335,54 @@ def get_project_path():
     return Path(__file__).absolute().parents[1]
 
 
+def bounded_map(executor, func, iterable, max_pending):
+    """
+    Like executor.map, keeping at most `max_pending` tasks in flight.
+
+    The arguments are drawn from `iterable` as the results are consumed,
+    so a generator is never read far ahead of the workers.
+    """
+    pending = deque()
+    for args in iterable:
+        pending.append(executor.submit(func, *args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def parallel_map(func, *iterables, workers=1, initializer=None, initargs=()):
+    """
+    Like map, across a pool of processes, returning a list in input order.
+
+    Parameters
+    ----------
+    func : callable
+        Function applied to the items, must be picklable.
+
+    *iterables : sequence
+        Arguments of `func`, one sequence per argument.
+
+    workers : int or None, optional
+        Number of processes. 1 runs serially; None uses all cores.
+
+    initializer, initargs : optional
+        Called once in each process before the items, see
+        `concurrent.futures.ProcessPoolExecutor`.
+    """
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return list(map(func, *iterables))
+    n_items = min(len(items) for items in iterables)
+    # a few chunks per process, to balance the load and limit the overhead
+    chunksize = max(1, n_items // (4 * (workers or os.cpu_count())))
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=initializer, initargs=initargs
+    ) as executor:
+        return list(executor.map(func, *iterables, chunksize=chunksize))
+
+
 def _check_tsv(df):
     """check if file is tsv"""
     if df.empty is True:
@@ -112,7 +395,7 @@ def _check_tsv(df):
     return df
 
 
-def read_tsv(filename, **kargs):
+def read_tsv(filename, backend="tsv", filters=None, **kargs):
     """
     Read tsv file
 
@@ -121,11 +404,227 @@ def read_tsv(filename, **kargs):
     filename: str or Path
         Path to tsv file
 
+    backend: str, optional
+        "tsv": parse the text file.
+        "parquet": read a typed columnar copy (`.parquet` next to the tsv),
+        converted from the tsv when missing or older than it.
+        Requires pyarrow.
+
+    filters: list of tuples, optional
+        Row filters in the form (column, op, value), combined with AND,
+        such as [("age", ">=", 20), ("age", "<", 40)].
+        op is one of "==", "!=", "<", ">", "<=", ">=", "in", "not in".
+        Pushed down to the reader with the parquet backend.
+
     **kargs:
         other inputs pass to panda.read_csv
+        With the parquet backend, `index_col` and `usecols` select columns
+        of the stored table; the rest are used for the conversion.
     """
     if kargs.get("sep", False):
         raise Exception("There's not need to provide input for `sep`.")
+    if backend == "parquet":
+        return _read_parquet(filename, filters=filters, **kargs)
+    if backend != "tsv":
+        raise ValueError(f"Unknown backend {backend}, use 'tsv' or 'parquet'.")
 
-    df = pd.read_csv(filename, sep="\t", **kargs)
-    return _check_tsv(df)
+    extra = []
+    if filters and kargs.get("usecols") is not None:
+        extra = [f[0] for f in filters if f[0] not in kargs["usecols"]]
+        kargs["usecols"] = list(kargs["usecols"]) + extra
+    df = _check_tsv(pd.read_csv(filename, sep="\t", **kargs))
+    if filters:
+        df = df[_filter_mask(df, filters)].drop(columns=extra)
+    return df
+
+
+_FILTER_OPS = {
+    "==": lambda col, val: col == val,
+    "!=": lambda col, val: col != val,
+    "<": lambda col, val: col < val,
+    ">": lambda col, val: col > val,
+    "<=": lambda col, val: col <= val,
+    ">=": lambda col, val: col >= val,
+    "in": lambda col, val: col.isin(val),
+    "not in": lambda col, val: ~col.isin(val),
+}
+
+
+def _filter_mask(df, filters):
+    """Rows matching all (column, op, value) filters."""
+    mask = np.ones(df.shape[0], dtype=bool)
+    for column, op, value in filters:
+        values = df.index if column == df.index.name else df[column]
+        mask &= np.asarray(_FILTER_OPS[op](values, value))
+    return mask
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as err:
+        raise ImportError(
+            "The parquet backend requires pyarrow, install it with "
+            "`pip install nkicap[parquet]`."
+        ) from err
+
+
+def parquet_path(filename):
+    """Path of the parquet copy of a tsv file."""
+    return Path(filename).with_suffix(".parquet")
+
+
+def tsv_to_parquet(filename, **kargs):
+    """
+    Convert a tsv file to parquet, saved next to it.
+
+    All columns, including the index column of the tsv, are stored as
+    typed columns.
+
+    Parameters
+    ----------
+    filename: str or Path
+        Path to tsv file
+
+    **kargs:
+        other inputs pass to panda.read_csv
+    """
+    _require_pyarrow()
+    df = read_tsv(filename, **kargs)
+    path = parquet_path(filename)
+    df.to_parquet(path, index=False)
+    return path
+
+
+def _ensure_parquet(filename, **kargs):
+    """Parquet copy of a tsv file, converted when missing or stale."""
+    _require_pyarrow()
+    path = parquet_path(filename)
+    tsv = Path(filename)
+    if not path.exists() or (
+        tsv.exists() and path.stat().st_mtime < tsv.stat().st_mtime
+    ):
+        tsv_to_parquet(tsv, **kargs)
+    return path
+
+
+def _read_parquet(filename, index_col=None, usecols=None, filters=None, **kargs):
+    """Read the parquet copy of a tsv file."""
+    path = _ensure_parquet(filename, **kargs)
+
+    if isinstance(index_col, int):
+        index_col = _parquet_columns(path)[index_col]
+    columns = None
+    if usecols is not None:
+        columns = list(usecols)
+        if index_col is not None and index_col not in columns:
+            columns = [index_col] + columns
+    df = pd.read_parquet(path, columns=columns, filters=filters or None)
+    if index_col is not None:
+        df = df.set_index(index_col)
+    return df
+
+
+def _parquet_columns(path):
+    """Column names of a parquet file, read from the schema only."""
+    import pyarrow.parquet as pq
+
+    return pq.read_schema(path).names
+
+
+class CAPStore:
+    """
+    CAP maps of all subjects in one memory mapped array.
+
+    The maps are stored as a single `.npy` file of shape (subject, ROI, CAP)
+    with a `.json` manifest of the same name holding the subject, ROI and CAP
+    labels. Nothing is read until a map is accessed.
+
+    Parameters
+    ----------
+    path: str or Path
+        Path to the `.npy` file.
+
+    Example
+    -------
+    >> store = CAPStore("data/enhanced_nki/desc-capmap_bold.npy")
+    >> store.subject("A00018030").shape
+    (1054, 8)
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path.with_suffix(".json")) as json_file:
+            manifest = json.load(json_file)
+        self.subjects = manifest["subject"]
+        self.roi = manifest["roi"]
+        self.caps = manifest["cap"]
+        self.data = np.load(self.path, mmap_mode="r")
+        self._subject_index = {sub: i for i, sub in enumerate(self.subjects)}
+        self._cap_index = {cap: i for i, cap in enumerate(self.caps)}
+
+    def __len__(self):
+        return len(self.subjects)
+
+    def subject(self, participant_id):
+        """Zero-copy view of one subject's maps, shape (ROI, CAP)."""
+        return self.data[self._subject_index[participant_id]]
+
+    def cap(self, label):
+        """Zero-copy view of one CAP across subjects, shape (subject, ROI)."""
+        return self.data[:, :, self._cap_index[label]]
+
+    def select(self, subjects):
+        """Maps of several subjects in the given order, shape (subject, ROI, CAP)."""
+        return self.data[[self._subject_index[sub] for sub in subjects]]
+
+    def to_frame(self, participant_id):
+        """One subject's maps in the layout of `sub-*_desc-capmap_bold.tsv`."""
+        return pd.DataFrame(
+            self.subject(participant_id), index=self.roi, columns=self.caps
+        )
+
+
+def create_cap_store(path, subjects, roi, caps, dtype="float64"):
+    """
+    Create an empty CAP map store and return it as a writable memory map.
+
+    Parameters
+    ----------
+    path: str or Path
+        Path to the `.npy` file. The manifest is saved next to it.
+
+    subjects, roi, caps: list
+        Labels of the subject, ROI and CAP axes.
+
+    dtype: str, optional
+        Data type of the maps.
+
+    Returns
+    -------
+    numpy.memmap, shape (subject, ROI, CAP)
+    """
+    path = Path(path)
+    manifest = {
+        "subject": np.asarray(subjects).tolist(),
+        "roi": np.asarray(roi).tolist(),
+        "cap": np.asarray(caps).tolist(),
+    }
+    with open(path.with_suffix(".json"), "w") as fp:
+        json.dump(manifest, fp, indent=2)
+    return np.lib.format.open_memmap(
+        path, mode="w+", dtype=dtype, shape=(len(subjects), len(roi), len(caps))
+    )
+
+
+def save_cap_store(path, maps, subjects, roi, caps):
+    """
+    Save stacked CAP maps of shape (subject, ROI, CAP) as a CAP map store.
+
+    See `create_cap_store` for the parameters.
+    """
+    maps = np.asarray(maps)
+    store = create_cap_store(path, subjects, roi, caps, dtype=maps.dtype)
+    store[:] = maps
+    store.flush()
+    return CAPStore(path)